@@ -0,0 +1,97 @@
+#####################################################################
+#                                                                   #
+# connection_table_scaling.py                                       #
+#                                                                   #
+# Copyright 2013, Monash University                                 #
+#                                                                   #
+# This file is part of the labscript suite (see                     #
+# http://labscriptsuite.org) and is licensed under the Simplified   #
+# BSD License. See the license.txt file in the root of the project  #
+# for the full license.                                             #
+#                                                                   #
+#####################################################################
+"""Benchmark of ConnectionTable construction time as a function of the number of
+devices, using synthetic connection tables of pseudoclocks, clocklines, intermediate
+devices and their output channels. Construction should scale linearly. Run with:
+
+.. code-block:: bash
+
+    python benchmarks/connection_table_scaling.py [max_rows]
+"""
+import sys
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from labscript_utils.connections import ConnectionTable
+import h5py
+from labscript_utils.properties import serialise
+
+DTYPE = [
+    ('name', 'S256'),
+    ('class', 'S256'),
+    ('parent', 'S256'),
+    ('parent port', 'S256'),
+    ('unit conversion class', 'S256'),
+    ('unit conversion params', 'S4096'),
+    ('BLACS_connection', 'S1024'),
+    ('properties', 'S4096'),
+]
+
+CHANNELS_PER_DEVICE = 32
+
+
+def make_table(n_rows):
+    """Return a structured array of a connection table with n_rows devices"""
+    properties = serialise({'max_frequency': 1e6, 'limits': [-10.0, 10.0]})
+    params = serialise({})
+    rows = [
+        (b'pulseblaster', b'PulseBlaster', b'None', b'None', b'None', params, b'0',
+         properties),
+        (b'clockline', b'ClockLine', b'pulseblaster', b'flag 0', b'None', params, b'',
+         properties),
+    ]
+    device = None
+    while len(rows) < n_rows:
+        i = len(rows)
+        if device is None or i % (CHANNELS_PER_DEVICE + 1) == 0:
+            device = b'device_%d' % i
+            rows.append(
+                (device, b'NI_PCIe_6363', b'clockline', b'internal', b'None', params,
+                 b'Dev%d' % i, properties)
+            )
+        else:
+            rows.append(
+                (b'channel_%d' % i, b'AnalogOut', device, b'ao%d' % i, b'None', params,
+                 b'', properties)
+            )
+    return np.array(rows[:n_rows], dtype=DTYPE)
+
+
+def time_construction(path, repeats=3):
+    """Return the best of several times to construct a ConnectionTable from path"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        ConnectionTable(path)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    max_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    sizes = [n for n in [100, 300, 1000, 3000, 10000, 30000, 50000] if n <= max_rows]
+    print('%8s %10s %12s' % ('rows', 'time (s)', 'us per row'))
+    with tempfile.TemporaryDirectory() as tempdir:
+        for n_rows in sizes:
+            path = os.path.join(tempdir, 'connection_table_%d.h5' % n_rows)
+            with h5py.File(path, 'w') as f:
+                f.create_dataset('connection table', data=make_table(n_rows))
+            elapsed = time_construction(path)
+            print('%8d %10.3f %12.1f' % (n_rows, elapsed, 1e6 * elapsed / n_rows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#####################################################################
+#                                                                   #
+# dict_diff_benchmark.py                                            #
+#                                                                   #
+# Copyright 2013, Monash University                                 #
+#                                                                   #
+# This file is part of the labscript suite (see                     #
+# http://labscriptsuite.org) and is licensed under the Simplified   #
+# BSD License. See the license.txt file in the root of the project  #
+# for the full license.                                             #
+#                                                                   #
+#####################################################################
+"""Benchmark of dict_diff() on two dicts of 100k globals, including array-valued
+ones, that differ in a small number of keys. Run with:
+
+.. code-block:: bash
+
+    python benchmarks/dict_diff_benchmark.py [n_globals]
+"""
+import sys
+import time
+
+import numpy as np
+
+from labscript_utils.dict_diff import dict_diff
+
+N_ARRAYS = 1000
+
+
+def make_globals(n_globals, rng):
+    """Return a dict of n_globals scalar, string and array globals"""
+    shot_globals = {}
+    for i in range(n_globals - N_ARRAYS):
+        if i % 3 == 0:
+            shot_globals['global_%d' % i] = float(rng.random())
+        elif i % 3 == 1:
+            shot_globals['global_%d' % i] = int(rng.integers(1000))
+        else:
+            shot_globals['global_%d' % i] = 'value_%d' % i
+    for i in range(N_ARRAYS):
+        shot_globals['array_%d' % i] = rng.random(100)
+    return shot_globals
+
+
+def main():
+    n_globals = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = np.random.default_rng(0)
+    dict1 = make_globals(n_globals, rng)
+    dict2 = {key: np.copy(value) if isinstance(value, np.ndarray) else value
+             for key, value in dict1.items()}
+    # Change some scalars and arrays, and add and remove a key:
+    for i in range(0, 300, 3):
+        dict2['global_%d' % i] += 1
+    dict2['array_0'] = dict2['array_0'] + 1
+    del dict2['global_1']
+    dict2['new_global'] = 0
+
+    times = []
+    for _ in range(5):
+        start = time.perf_counter()
+        diff = dict_diff(dict1, dict2)
+        times.append(time.perf_counter() - start)
+    print('%d globals, %d differences' % (n_globals, len(diff)))
+    print('best of %d: %.4f s' % (len(times), min(times)))
+
+
+if __name__ == '__main__':
+    main()
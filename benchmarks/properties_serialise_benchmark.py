@@ -0,0 +1,133 @@
+#####################################################################
+#                                                                   #
+# properties_serialise_benchmark.py                                 #
+#                                                                   #
+# Copyright 2013, Monash University                                 #
+#                                                                   #
+# This file is part of the labscript suite (see                     #
+# http://labscriptsuite.org) and is licensed under the Simplified   #
+# BSD License. See the license.txt file in the root of the project  #
+# for the full license.                                             #
+#                                                                   #
+#####################################################################
+"""Benchmark of properties.serialise() and deserialise() on property dicts with
+thousands of entries, compared with the previous implementation, reproduced here,
+which walked and rebuilt the value before encoding it and again after decoding it.
+Run with:
+
+.. code-block:: bash
+
+    python benchmarks/properties_serialise_benchmark.py [n_entries]
+"""
+import sys
+import json
+import time
+from base64 import b64encode, b64decode
+from collections.abc import Iterable, Mapping
+
+import numpy as np
+
+from labscript_utils.properties import (
+    serialise,
+    deserialise,
+    JSON_IDENTIFIER,
+    BASE64_IDENTIFIER,
+)
+
+
+def _check_dicts_before(o):
+    if isinstance(o, Mapping):
+        if not all(isinstance(k, (str, bytes)) for k in o.keys()):
+            raise TypeError("Cannot JSON encode dictionary with non-string keys")
+        for item in o.values():
+            _check_dicts_before(item)
+    elif isinstance(o, Iterable) and not isinstance(o, (str, bytes)):
+        for item in o:
+            _check_dicts_before(item)
+
+
+def _encode_bytestrings_before(o):
+    if isinstance(o, Mapping):
+        return {key: _encode_bytestrings_before(value) for key, value in o.items()}
+    elif isinstance(o, Iterable) and not isinstance(o, (str, bytes)):
+        return list([_encode_bytestrings_before(value) for value in o])
+    elif isinstance(o, bytes):
+        return BASE64_IDENTIFIER + str(b64encode(o).decode())
+    else:
+        return o
+
+
+def _decode_bytestrings_before(o):
+    if isinstance(o, Mapping):
+        return {key: _decode_bytestrings_before(value) for key, value in o.items()}
+    elif isinstance(o, Iterable) and not isinstance(o, (str, bytes)):
+        return list([_decode_bytestrings_before(value) for value in o])
+    elif isinstance(o, str) and o.startswith(BASE64_IDENTIFIER):
+        return b64decode(o[len(BASE64_IDENTIFIER):])
+    else:
+        return o
+
+
+def _default_before(o):
+    if isinstance(o, np.integer):
+        return int(o)
+    raise TypeError
+
+
+def serialise_before(value):
+    _check_dicts_before(value)
+    value = _encode_bytestrings_before(value)
+    return JSON_IDENTIFIER + json.dumps(value, default=_default_before)
+
+
+def deserialise_before(value):
+    return _decode_bytestrings_before(json.loads(value[len(JSON_IDENTIFIER):]))
+
+
+def make_properties(n_entries, with_bytes=False):
+    """Return a property dict of n_entries scalars, strings, lists and nested dicts,
+    and a large array, as the previous implementation could serialise"""
+    properties = {}
+    for i in range(n_entries):
+        kind = i % 4
+        if kind == 0:
+            properties['float_%d' % i] = i * 0.5
+        elif kind == 1:
+            properties['str_%d' % i] = 'value %d' % i
+        elif kind == 2:
+            properties['list_%d' % i] = [i, i + 1, i + 2]
+        else:
+            properties['dict_%d' % i] = {'a': i, 'b': [1.0, 2.0]}
+    properties['lookup_table'] = np.arange(100000)
+    if with_bytes:
+        properties['firmware'] = bytes(range(256)) * 40
+    return properties
+
+
+def best_time(function, value, repeats=5):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(value)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    n_entries = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    print('%-30s %12s %12s' % ('', 'before (ms)', 'after (ms)'))
+    for with_bytes in [False, True]:
+        properties = make_properties(n_entries, with_bytes)
+        serialised = serialise(properties)
+        assert serialised == serialise_before(properties)
+        label = '%d entries%s' % (n_entries, ' + bytes' if with_bytes else '')
+        before = best_time(serialise_before, properties)
+        after = best_time(serialise, properties)
+        print('%-30s %12.1f %12.1f' % ('serialise, ' + label, 1e3 * before, 1e3 * after))
+        before = best_time(deserialise_before, serialised)
+        after = best_time(deserialise, serialised)
+        print('%-30s %12.1f %12.1f' % ('deserialise, ' + label, 1e3 * before, 1e3 * after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#####################################################################
+#                                                                   #
+# zlock_lease_benchmark.py                                          #
+#                                                                   #
+# Copyright 2013, Monash University                                 #
+#                                                                   #
+# This file is part of the labscript suite (see                     #
+# http://labscriptsuite.org) and is licensed under the Simplified   #
+# BSD License. See the license.txt file in the root of the project  #
+# for the full license.                                             #
+#                                                                   #
+#####################################################################
+"""Benchmark of repeatedly opening the same HDF5 file read-only with h5_lock, with and
+without read-only zlock leases, see labscript_utils.ls_zprocess.LockLeases. Runs
+against the zlock server configured in labconfig, which if configured to be on
+localhost is started if it is not already running. Run with:
+
+.. code-block:: bash
+
+    python benchmarks/zlock_lease_benchmark.py [n_opens]
+"""
+import sys
+import os
+import tempfile
+import time
+
+import labscript_utils.h5_lock
+from labscript_utils.ls_zprocess import set_lock_lease_time, get_lock_lease_stats
+import h5py
+
+
+def opens_per_second(path, n_opens):
+    start = time.perf_counter()
+    for _ in range(n_opens):
+        with h5py.File(path, 'r'):
+            pass
+    return n_opens / (time.perf_counter() - start)
+
+
+def main():
+    n_opens = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, 'shot.h5')
+        with h5py.File(path, 'w') as f:
+            f.attrs['x'] = 1
+        # Warm up the connection to the zlock server:
+        opens_per_second(path, 10)
+        print('no lease:   %8.0f opens/s' % opens_per_second(path, n_opens))
+        set_lock_lease_time(1)
+        try:
+            print('1 s lease:  %8.0f opens/s' % opens_per_second(path, n_opens))
+            print(get_lock_lease_stats())
+        finally:
+            set_lock_lease_time(0)
+
+
+if __name__ == '__main__':
+    main()
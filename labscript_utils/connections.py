@@ -18,20 +18,129 @@ import labscript_utils.excepthook
 import numpy as np
 import copy
 import ast
+from collections.abc import Mapping, Sequence
+import os
+import hashlib
+import pickle
+import tempfile
 from labscript_utils.dict_diff import dict_diff
 import sys
 from zprocess import raise_exception_in_thread
+from labscript_profile import LABSCRIPT_SUITE_PROFILE
 
 def _ensure_str(s):
     """convert bytestrings and numpy strings to python strings"""
     return s.decode() if isinstance(s, bytes) else str(s)
 
 
+# Sentinel for Connection fields that are deserialised lazily and have not been yet:
+_NOT_DESERIALISED = object()
+
+
+def _freeze(value):
+    """Return a read-only view of value if it is a dict or list, or a read-only
+    equivalent if it is a tuple or set. Other values are returned as-is."""
+    if isinstance(value, dict):
+        return _FrozenDict(value)
+    elif isinstance(value, list):
+        return _FrozenList(value)
+    elif isinstance(value, tuple):
+        return tuple(_freeze(item) for item in value)
+    elif isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+class _FrozenDict(Mapping):
+    """Read-only view of a dict, without copying it. Nested dicts and lists are
+    also returned as read-only views. Compares equal to the dict it wraps. Call
+    copy() to get a mutable (deep) copy."""
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, key):
+        return _freeze(self._data[key])
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __eq__(self, other):
+        if isinstance(other, (_FrozenDict, _FrozenList)):
+            other = other._data
+        return self._data == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self._data)
+
+    def copy(self):
+        return copy.deepcopy(self._data)
+
+
+class _FrozenList(Sequence):
+    """Read-only view of a list, without copying it. Nested dicts and lists are also
+    returned as read-only views. Compares equal to the list it wraps. Call copy() to
+    get a mutable (deep) copy."""
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, index):
+        return _freeze(self._data[index])
+
+    def __len__(self):
+        return len(self._data)
+
+    def __eq__(self, other):
+        if isinstance(other, (_FrozenDict, _FrozenList)):
+            other = other._data
+        return self._data == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self._data)
+
+    def copy(self):
+        return copy.deepcopy(self._data)
+
+
 class ConnectionTable(object):
-    def __init__(self, h5file, logging_prefix=None, exceptions_in_thread=False):
+    def __init__(
+        self,
+        h5file,
+        logging_prefix=None,
+        exceptions_in_thread=False,
+        lazy=False,
+        cache=None,
+    ):
         """Object to represent a connection table. Set logging prefix if you
-        desire logging. Log used will be <prefix>.ConnectionTable"""
+        desire logging. Log used will be <prefix>.ConnectionTable. If lazy=True,
+        device properties and unit conversion parameters are deserialised from
+        self.raw_table only when first accessed, rather than all at load time. This
+        makes loading large tables faster, but errors in those fields are raised on
+        access instead of when parsing the table. If cache is a
+        ConnectionTableCache, the parsed table is loaded from it if the file has
+        not changed since it was cached, without opening the HDF5 file, and is
+        stored in it otherwise."""
         self.filepath = h5file
+        self.lazy = lazy
         self.logger = None
         if logging_prefix is not None:
             self.logger = logging.getLogger('{}.ConnectionTable'.format(logging_prefix))
@@ -39,9 +148,22 @@ class ConnectionTable(object):
             
         self.toplevel_children = {}
         self.table = {}
+        # Index of connections by (parent_name, parent_port), in table order:
+        self._connections_by_port = {}
+        # Row of self.raw_table each device in self.table was parsed from:
+        self._row_indices = {}
         self.master_pseudoclock = None
         self.raw_table = np.empty(0)
 
+        if cache is not None:
+            cache_entry = cache.load(h5file)
+            if cache_entry is not None:
+                if self.logger: self.logger.debug('Using cached connection table')
+                self.raw_table = cache_entry['raw_table']
+                self.master_pseudoclock = cache_entry['master_pseudoclock']
+                self._parse(exceptions_in_thread, cache_entry['fields'])
+                return
+
         try:
             with h5py.File(h5file,'r') as hdf5_file:
                 try:
@@ -61,20 +183,21 @@ class ConnectionTable(object):
                 except KeyError:
                     pass
 
-                try:
-                    all_connections = [Connection(raw_row) for raw_row in self.raw_table]
-                    self.table = {connection.name: connection for connection in all_connections}
-                    for name, connection in self.table.items():
-                        connection._populate_relatives(self.table)
-                        if connection.parent_port is None:
-                            self.toplevel_children[name] = connection
-                except Exception:
-                    msg = 'Could not parse connection table in %s' % h5file
-                    if self.logger: self.logger.error(msg)
-                    if exceptions_in_thread:
-                        raise_exception_in_thread(sys.exc_info())
-                    else:
-                        raise
+                cache_entry = None
+                if cache is not None:
+                    # The file may have been modified without the table changing:
+                    cache_entry = cache.load_by_content(
+                        h5file, self.raw_table, self.master_pseudoclock
+                    )
+                if cache_entry is not None:
+                    self._parse(exceptions_in_thread, cache_entry['fields'])
+                elif self._parse(exceptions_in_thread) and cache is not None:
+                    try:
+                        cache.store(self)
+                    except Exception:
+                        if self.logger:
+                            msg = 'Could not cache connection table'
+                            self.logger.warning(msg, exc_info=True)
 
         except Exception:
             msg = 'Could not open connection table file %s' % h5file
@@ -84,35 +207,144 @@ class ConnectionTable(object):
             else:
                 raise
 
+    def _parse(self, exceptions_in_thread, cached_fields=None):
+        """Create Connection objects for the rows in self.raw_table and link them
+        together. If cached_fields is given, it is a dict of previously deserialised
+        (unit conversion params, properties) for each device name, which are used
+        instead of deserialising them again. Returns whether parsing succeeded."""
+        try:
+            lazy = self.lazy or cached_fields is not None
+            all_connections = [Connection(raw_row, lazy) for raw_row in self.raw_table]
+            self.table = {connection.name: connection for connection in all_connections}
+            self._row_indices = {c.name: i for i, c in enumerate(all_connections)}
+            if cached_fields is not None:
+                for name, connection in self.table.items():
+                    fields = cached_fields[name]
+                    connection._unit_conversion_params, connection._properties = fields
+            self._populate_relatives()
+        except Exception:
+            msg = 'Could not parse connection table in %s' % self.filepath
+            if self.logger: self.logger.error(msg)
+            if exceptions_in_thread:
+                raise_exception_in_thread(sys.exc_info())
+            else:
+                raise
+            return False
+        return True
+
+    def _populate_relatives(self):
+        """Link every connection to its parent and children in a single pass over the
+        table, and collect the toplevel children. Equivalent to calling
+        Connection._populate_relatives(self.table) on every connection, but linear
+        rather than quadratic in the number of devices. Also builds the index used
+        by find_child()."""
+        for name, connection in self.table.items():
+            connection._connection_table = self
+            parent = self.table.get(connection.parent_name)
+            if parent is not None:
+                connection.parent = parent
+                parent.child_list[name] = connection
+            if connection.parent_port is None:
+                self.toplevel_children[name] = connection
+            key = (connection.parent_name, connection.parent_port)
+            self._connections_by_port.setdefault(key, []).append(connection)
+
+    def _is_reachable(self, connection):
+        """Return whether a connection can be reached by descending from one of the
+        toplevel children, which is the set of devices find_by_name() searches"""
+        # Bound the number of steps in case of a malformed table with a cycle of
+        # parents:
+        for _ in range(len(self.raw_table) + 1):
+            if connection is None:
+                return False
+            if self.toplevel_children.get(connection.name) is connection:
+                return True
+            connection = connection.parent
+        return False
+
+    def _active_rows(self):
+        """The rows of self.raw_table for the devices in self.table, in table order,
+        i.e. excluding any removed with remove_device()"""
+        indices = np.fromiter(self._row_indices.values(), dtype=int)
+        indices.sort()
+        return self.raw_table[indices]
+
+    def diff(self, other):
+        """Return a ConnectionTableDiff of the devices added, removed and changed in
+        the other ConnectionTable relative to this one. Rows are matched by name and
+        their raw values compared column-wise in bulk, such that only rows whose raw
+        values differ need to be deserialised and compared in detail."""
+        ours = self._active_rows()
+        theirs = other._active_rows()
+        if not ours.dtype.names or not theirs.dtype.names:
+            # At least one table is empty:
+            removed = [name for name in self.table if name not in other.table]
+            added = [name for name in other.table if name not in self.table]
+            return ConnectionTableDiff(added, removed, {})
+
+        common, our_indices, their_indices = np.intersect1d(
+            ours['name'], theirs['name'], assume_unique=True, return_indices=True
+        )
+
+        # Devices only in one table, in table order:
+        only_ours = np.ones(len(ours), dtype=bool)
+        only_ours[our_indices] = False
+        only_theirs = np.ones(len(theirs), dtype=bool)
+        only_theirs[their_indices] = False
+        removed = [_ensure_str(name) for name in ours['name'][only_ours]]
+        added = [_ensure_str(name) for name in theirs['name'][only_theirs]]
+
+        # Devices in both whose raw rows differ in any column:
+        candidates = np.zeros(len(common), dtype=bool)
+        for field in set(ours.dtype.names) | set(theirs.dtype.names):
+            if (
+                field in ours.dtype.names
+                and field in theirs.dtype.names
+                and ours.dtype[field].kind == theirs.dtype[field].kind
+            ):
+                ours_column = ours[field][our_indices]
+                theirs_column = theirs[field][their_indices]
+                candidates |= ours_column != theirs_column
+            else:
+                # Missing columns take default values, compare in detail:
+                candidates[:] = True
+                break
+
+        # Compare the candidates in detail, since equal values may have been
+        # serialised differently. In the other table's order:
+        changed = {}
+        candidate_indices = np.flatnonzero(candidates)
+        candidate_indices = candidate_indices[np.argsort(their_indices[candidates])]
+        for name in common[candidate_indices]:
+            name = _ensure_str(name)
+            connection = self.table[name]
+            other_connection = other.table[name]
+            if connection != other_connection:
+                changed[name] = connection.diff(other_connection)
+
+        return ConnectionTableDiff(added, removed, changed)
+
     def assert_superset(self, other):
         # let's check that we're a superset of the connection table in "other"
         if not isinstance(other, ConnectionTable):
             msg = "Loaded file is not a valid connection table"
             raise TypeError(msg)
         
-        missing = []    # things I don't know exist
+        diff = self.diff(other)
+        missing = ['  ' + name for name in diff.added]  # things I don't know exist
         incompat = []   # things that are different from what I expect
         
-        for name, other_connection in other.table.items():
-            # does it exist?
-            try:
-                connection = self.table[name]
-            except KeyError:
-                missing.append('  ' + name)
-            else:
-                # is it the same?   
-                if connection != other_connection:
-                    diff = connection.diff(other_connection)
-                    msg = '  ' + name + ':\n'
-                    for key, (ours, theirs) in diff.items():
-                        if isinstance(ours, dict) and isinstance(theirs, dict):
-                            msg += '    {}:\n'.format(key)
-                            subdiff = dict_diff(ours, theirs)
-                            for key, (ours, theirs) in subdiff.items():
-                                msg += '      {}: {} != {}'.format(key, ours, theirs)
-                        else:
-                            msg += '    {}: {} != {}'.format(key, ours, theirs)
-                    incompat.append(msg)
+        for name, fields in diff.changed.items():
+            msg = '  ' + name + ':\n'
+            for key, (ours, theirs) in fields.items():
+                if isinstance(ours, dict) and isinstance(theirs, dict):
+                    msg += '    {}:\n'.format(key)
+                    subdiff = dict_diff(ours, theirs)
+                    for key, (ours, theirs) in subdiff.items():
+                        msg += '      {}: {} != {}'.format(key, ours, theirs)
+                else:
+                    msg += '    {}: {} != {}'.format(key, ours, theirs)
+            incompat.append(msg)
         
         # construct a human-readable explanation
         errmsg = ""
@@ -173,21 +405,16 @@ class ConnectionTable(object):
     # connected via "parent_port" Eg, Returns the child of "pulseblaster_0"
     # connected via "dds 0"
     def find_child(self, parent_name, parent_port):
-        for name, connection in self.table.items():
-            if (connection.parent_name == parent_name 
-                    and connection.parent_port == parent_port):
-                return connection
+        connections = self._connections_by_port.get((parent_name, parent_port))
+        if connections:
+            return connections[0]
         return None
     
     def find_by_name(self,name):
         name = _ensure_str(name)
-        for device_name, connection in self.toplevel_children.items():
-            if device_name == name:
-                return connection
-            else:
-                result = connection.find_by_name(name)
-                if result is not None:
-                    return result
+        connection = self.table.get(name)
+        if connection is not None and self._is_reachable(connection):
+            return connection
         return None
 
     def remove_device(self, device_name):
@@ -198,43 +425,93 @@ class ConnectionTable(object):
             del self.toplevel_children[device_name]
         if device_name == self.master_pseudoclock:
             self.master_pseudoclock = None
-        del self.table[device_name]
+        connection = self.table.pop(device_name)
+        del self._row_indices[device_name]
+        key = (connection.parent_name, connection.parent_port)
+        self._connections_by_port[key].remove(connection)
+        if not self._connections_by_port[key]:
+            del self._connections_by_port[key]
 
 
 class Connection(object):
     """A class to represent a row in the connection table, present the
     contents as instance attributes after deserialising their contents, and
     providing default values for backward compatibility with older HDF5 files.
-    Contains links to Connection objects for child devices of each device"""
+    Contains links to Connection objects for child devices of each device.
+
+    If lazy=True, the 'properties' and 'unit conversion params' fields, which are
+    the expensive ones to deserialise, are kept as raw values in the row and only
+    deserialised the first time they are accessed. raw_row is a view into the
+    connection table's structured array, so it is not copied."""
     _defaults = {'unit conversion class': None,
                 'unit conversion params': {},
                 'BLACS_connection': "",
                 'properties': {}}
 
-    def __init__(self, raw_row):
+    __slots__ = ('name', 'device_class', 'parent_name', 'parent_port',
+                 'unit_conversion_class', 'BLACS_connection', 'child_list', 'parent',
+                 '_raw_row', '_unit_conversion_params', '_properties',
+                 '_row_hash', '_subtree_hash', '_connection_table', '__weakref__')
 
-        # Populate a dict with the defaults:
-        self._rowdict = self._defaults.copy()
+    def __init__(self, raw_row, lazy=False):
+        self._raw_row = raw_row
 
-        # Put the given values in, overwriting the defaults if applicable:
-        deserialised_items = {_ensure_str(name): self._deserialise(name, value)
-                              for name, value in zip(raw_row.dtype.names, raw_row)}
-
-        self._rowdict.update(deserialised_items)
-            
         # Populate attributes:
-        self.name = self._rowdict['name']
-        self.device_class = self._rowdict['class']
-        self.parent_name = self._rowdict['parent']
-        self.parent_port = self._rowdict['parent port']
-        self.unit_conversion_class = self._rowdict['unit conversion class']
-        self._unit_conversion_params = self._rowdict['unit conversion params']
-        self.BLACS_connection = self._rowdict['BLACS_connection']
-        self._properties = self._rowdict['properties']
-        
+        self.name = self._get_field('name')
+        self.device_class = self._get_field('class')
+        self.parent_name = self._get_field('parent')
+        self.parent_port = self._get_field('parent port')
+        self.unit_conversion_class = self._get_field('unit conversion class')
+        self.BLACS_connection = self._get_field('BLACS_connection')
+        self._unit_conversion_params = _NOT_DESERIALISED
+        self._properties = _NOT_DESERIALISED
+        # Computed when first needed by self._get_row_hash/_get_subtree_hash:
+        self._row_hash = None
+        self._subtree_hash = None
+        if not lazy:
+            self._get_unit_conversion_params()
+            self._get_properties()
+
         # To be populated by self._populate_relatives:
         self.child_list = {}
         self.parent = None
+
+        # The ConnectionTable we belong to, if any, whose indexes are used to speed
+        # up find_child() and find_by_name():
+        self._connection_table = None
+
+    def _get_field(self, name):
+        """Deserialise the given field of the row, or return its default value if
+        the row does not have it"""
+        # Use the cached values of the fields that are deserialised lazily:
+        if name == 'unit conversion params':
+            if self._unit_conversion_params is not _NOT_DESERIALISED:
+                return self._unit_conversion_params
+        elif name == 'properties':
+            if self._properties is not _NOT_DESERIALISED:
+                return self._properties
+        if name in self._raw_row.dtype.names:
+            return self._deserialise(name, self._raw_row[name])
+        # KeyError if there is no default, as for a missing required field:
+        return self._defaults[name]
+
+    def _get_unit_conversion_params(self):
+        if self._unit_conversion_params is _NOT_DESERIALISED:
+            self._unit_conversion_params = self._get_field('unit conversion params')
+        return self._unit_conversion_params
+
+    def _get_properties(self):
+        if self._properties is _NOT_DESERIALISED:
+            self._properties = self._get_field('properties')
+        return self._properties
+
+    @property
+    def _rowdict(self):
+        """All fields of the row, deserialised, with defaults for any missing"""
+        rowdict = self._defaults.copy()
+        for name in self._raw_row.dtype.names:
+            rowdict[_ensure_str(name)] = self._get_field(name)
+        return rowdict
         
     def _deserialise(self, name, value):
         """deserialise one item of the row depending on what it is"""
@@ -265,21 +542,48 @@ class Connection(object):
             if name == self.parent_name:
                 self.parent = connection
 
+    def _get_row_hash(self):
+        """Hash of the raw contents of the row. Connections with equal row hashes
+        are equal. Unequal hashes do not imply unequal connections, since equal
+        contents may have been serialised differently."""
+        if self._row_hash is None:
+            row = self._raw_row
+            contents = repr((row.dtype.names, row.item())).encode('utf8')
+            self._row_hash = hashlib.blake2b(contents, digest_size=16).digest()
+        return self._row_hash
+
+    def _get_subtree_hash(self):
+        """Merkle hash of this row and the subtrees of all our children,
+        irrespective of their order. If two connections have equal subtree hashes,
+        compare_to() will find no differences between them."""
+        if self._subtree_hash is None:
+            h = hashlib.blake2b(self._get_row_hash(), digest_size=16)
+            child_hashes = [c._get_subtree_hash() for c in self.child_list.values()]
+            for child_hash in sorted(child_hashes):
+                h.update(child_hash)
+            self._subtree_hash = h.digest()
+        return self._subtree_hash
+
     def __eq__(self, other):
+        if self._get_row_hash() == other._get_row_hash():
+            return True
         return self._rowdict == other._rowdict
 
     def __ne__(self, other):
-        return self._rowdict != other._rowdict
+        return not self == other
 
     @property
     def unit_conversion_params(self):
-        # Return a copy so calling code can't modify our instance attribute
-        return copy.deepcopy(self._unit_conversion_params)
+        # Return a copy so calling code can't modify our instance attribute. Not a
+        # read-only view like self.properties, since unit conversion classes modify
+        # their parameters, and these dicts are small:
+        return copy.deepcopy(self._get_unit_conversion_params())
         
     @property
     def properties(self):
-        # Return a copy so calling code can't modify our instance attribute
-        return copy.deepcopy(self._properties)
+        # Return a read-only view so calling code can't modify our instance
+        # attribute. Its copy() method returns a mutable copy.
+        return _freeze(self._get_properties())
         
     def diff(self, other):
         return dict_diff(self._rowdict, other._rowdict)
@@ -287,6 +591,10 @@ class Connection(object):
     def compare_to(self, other_connection):
         if not isinstance(other_connection,Connection):
             return False,{"error":"Internal Error. Connection Table object is corrupted."}
+
+        # Identical subtrees need no further comparison:
+        if self._get_subtree_hash() == other_connection._get_subtree_hash():
+            return True, {}
             
         error = {}
         # Compare all parameters between this connection, and other connection
@@ -298,7 +606,10 @@ class Connection(object):
             error["parent_port"] = True
         if self.unit_conversion_class != other_connection.unit_conversion_class:
             error["unit_conversion_class"] = True
-        if self.unit_conversion_params != other_connection.unit_conversion_params:
+        if (
+            self._get_unit_conversion_params()
+            != other_connection._get_unit_conversion_params()
+        ):
             error["unit_conversion_params"] = True
         if self.BLACS_connection != other_connection.BLACS_connection:
             error["BLACS_connection"] = True
@@ -329,7 +640,25 @@ class Connection(object):
             print(indent + name)
             child.print_details(indent + '  ')
     
+    def _is_ancestor_of(self, connection):
+        # Bound the number of steps in case of a malformed table with a cycle of
+        # parents:
+        for _ in range(len(self._connection_table.raw_table) + 1):
+            connection = connection.parent
+            if connection is None:
+                return False
+            if connection is self:
+                return True
+        return False
+
     def find_child(self, parent_name, parent_port):
+        if self._connection_table is not None:
+            index = self._connection_table._connections_by_port
+            for connection in index.get((parent_name, parent_port), ()):
+                if self._is_ancestor_of(connection):
+                    return connection
+            return None
+
         for name, connection in self.child_list.items():
             if connection.parent_name == parent_name and connection.parent_port == parent_port:
                 return connection
@@ -345,6 +674,12 @@ class Connection(object):
 
     def find_by_name(self, name):
         name = _ensure_str(name)
+        if self._connection_table is not None:
+            connection = self._connection_table.table.get(name)
+            if connection is not None and self._is_ancestor_of(connection):
+                return connection
+            return None
+
         for device_name, connection in self.child_list.items():
             if device_name == name:
                 return connection
@@ -355,6 +690,173 @@ class Connection(object):
         return None    
 
 
+class ConnectionTableDiff(object):
+    """The differences between two connection tables, as returned by
+    ConnectionTable.diff(). Has the attributes:
+
+        added: list of names of devices only in the other table
+        removed: list of names of devices only in this table
+        changed: dict of {name: {field: [ours, theirs]}} for devices in both tables
+            whose fields differ, with the fields as in Connection.diff()
+
+    Is truthy if there are any differences."""
+
+    def __init__(self, added, removed, changed):
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __repr__(self):
+        return '<ConnectionTableDiff: %d added, %d removed, %d changed>' % (
+            len(self.added),
+            len(self.removed),
+            len(self.changed),
+        )
+
+
+class ConnectionTableCache(object):
+    """A persistent on-disk cache of parsed connection tables, for passing to
+    ConnectionTable() as the cache argument.
+
+    Each cached table is stored as a pickle file named by a hash of the contents of
+    the connection table dataset, containing the raw table and the deserialised
+    properties and unit conversion parameters of every device. A second, small file
+    named by a hash of the HDF5 file's path, size and modification time points to
+    it, such that a table can be loaded from the cache without opening the HDF5
+    file at all if the file is unchanged. If the file has been modified but the
+    connection table within it has not, the HDF5 file is read but deserialising its
+    contents is skipped. At most max_entries of each kind of file are kept, with
+    the least recently used removed first. If cache_dir is None, defaults to
+    <labscript_suite_profile>/cache/connection_tables. Any problem reading from the
+    cache is treated as a cache miss."""
+
+    # Increment if the format of cache entries changes:
+    VERSION = 1
+
+    def __init__(self, cache_dir=None, max_entries=32):
+        if cache_dir is None:
+            cache_dir = os.path.join(
+                LABSCRIPT_SUITE_PROFILE, 'cache', 'connection_tables'
+            )
+        self.cache_dir = str(cache_dir)
+        self.max_entries = max_entries
+
+    @staticmethod
+    def content_hash(raw_table, master_pseudoclock):
+        """Hash of a connection table's contents, used to name cache entries"""
+        h = hashlib.sha256(repr((raw_table.dtype.descr, master_pseudoclock)).encode())
+        h.update(np.ascontiguousarray(raw_table).tobytes())
+        return h.hexdigest()
+
+    def _stat_path(self, h5file):
+        stat = os.stat(h5file)
+        key = '%s\0%d\0%d' % (os.path.realpath(h5file), stat.st_size, stat.st_mtime_ns)
+        name = 'stat-' + hashlib.sha256(key.encode('utf8')).hexdigest()
+        return os.path.join(self.cache_dir, name)
+
+    def _table_path(self, content_hash):
+        return os.path.join(self.cache_dir, 'table-%s.pickle' % content_hash)
+
+    def _write(self, path, data):
+        # Write to a temporary file and rename it so that other processes never see a
+        # partially written file:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+    def _load_table(self, content_hash):
+        path = self._table_path(content_hash)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+            if entry['version'] != self.VERSION or entry['hash'] != content_hash:
+                return None
+            # Mark as recently used:
+            os.utime(path)
+        except Exception:
+            return None
+        return entry
+
+    def load(self, h5file):
+        """Return the cache entry for the given file if the file has not been
+        modified since it was cached, otherwise None"""
+        try:
+            path = self._stat_path(h5file)
+            with open(path) as f:
+                content_hash = f.read()
+            os.utime(path)
+        except Exception:
+            return None
+        return self._load_table(content_hash)
+
+    def load_by_content(self, h5file, raw_table, master_pseudoclock):
+        """Return the cache entry for the given connection table contents, or None
+        if there is none. If there is one, record that h5file, in its current state,
+        contains it."""
+        content_hash = self.content_hash(raw_table, master_pseudoclock)
+        entry = self._load_table(content_hash)
+        if entry is not None:
+            try:
+                self._write(self._stat_path(h5file), content_hash.encode())
+            except OSError:
+                pass
+        return entry
+
+    def store(self, connection_table):
+        """Add a parsed ConnectionTable to the cache. This deserialises the
+        properties and unit conversion parameters of all devices if they have not
+        been already."""
+        content_hash = self.content_hash(
+            connection_table.raw_table, connection_table.master_pseudoclock
+        )
+        fields = {
+            name: (
+                connection._get_unit_conversion_params(),
+                connection._get_properties(),
+            )
+            for name, connection in connection_table.table.items()
+        }
+        entry = {
+            'version': self.VERSION,
+            'hash': content_hash,
+            'raw_table': connection_table.raw_table,
+            'master_pseudoclock': connection_table.master_pseudoclock,
+            'fields': fields,
+        }
+        data = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+        self._write(self._table_path(content_hash), data)
+        self._write(self._stat_path(connection_table.filepath), content_hash.encode())
+        self._evict()
+
+    def _evict(self):
+        """Remove the least recently used files beyond max_entries of each kind"""
+        for prefix in ['table-', 'stat-']:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if name.startswith(prefix):
+                    path = os.path.join(self.cache_dir, name)
+                    try:
+                        entries.append((os.path.getmtime(path), path))
+                    except OSError:
+                        # Removed by another process
+                        continue
+            entries.sort()
+            for _, path in entries[: max(len(entries) - self.max_entries, 0)]:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+
 # if __name__ == '__main__':
 #     a = ConnectionTable('/home/bilbo/labscript_suite/labconfig/bilbo-Precision-5520_BLACS.h5')
 #     c = ConnectionTable('/home/bilbo/labscript_shared/Experiments/cjb7_dev/connectiontable.h5')
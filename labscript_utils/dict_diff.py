@@ -13,30 +13,73 @@
 
 import numpy as np
 
-def dict_diff(dict1, dict2):
+
+def _values_differ(value1, value2):
+    """Return whether two values differ. ndarrays are compared by shape, dtype and
+    contents, dicts and sequences element-wise if comparing them directly is
+    ambiguous, and anything else with !="""
+    if value1 is value2:
+        return False
+    if isinstance(value1, np.ndarray) or isinstance(value2, np.ndarray):
+        if (
+            isinstance(value1, np.ndarray)
+            and isinstance(value2, np.ndarray)
+            and not value1.dtype.hasobject
+            and not value2.dtype.hasobject
+        ):
+            return (
+                value1.shape != value2.shape
+                or value1.dtype != value2.dtype
+                or value1.tobytes() != value2.tobytes()
+            )
+        return not np.array_equal(value1, value2)
+    if isinstance(value1, dict) and isinstance(value2, dict):
+        if value1.keys() != value2.keys():
+            return True
+        return any(_values_differ(value1[key], value2[key]) for key in value1)
+    try:
+        return bool(value1 != value2)
+    except ValueError:
+        # Truth value ambiguous, e.g. lists containing arrays. Compare elementwise:
+        if isinstance(value1, (list, tuple)) and isinstance(value2, (list, tuple)):
+            if type(value1) is not type(value2) or len(value1) != len(value2):
+                return True
+            return any(_values_differ(a, b) for a, b in zip(value1, value2))
+        return not np.array_equal(value1, value2)
+
+
+def dict_diff(dict1, dict2, max_depth=0):
     """Return the difference between two dictionaries as a dictionary of key: [val1, val2] pairs.
-    Keys unique to either dictionary are included as key: [val1, '-'] or key: ['-', val2]."""
-    diff_keys = []
-    common_keys = np.intersect1d(list(dict1.keys()), list(dict2.keys()))
-    for key in common_keys:
-        if np.iterable(dict1[key]):
-            if np.any(dict1[key] != dict2[key]):
-                diff_keys.append(key)
-        else:
-            if dict1[key] != dict2[key]:
-                diff_keys.append(key)
-
-    dict1_unique = [key for key in dict1.keys() if key not in common_keys]    
-    dict2_unique = [key for key in dict2.keys() if key not in common_keys]
-                
+    Keys unique to either dictionary are included as key: [val1, '-'] or key: ['-', val2].
+
+    If max_depth is nonzero, values that are dicts in both dictionaries are compared
+    recursively, up to max_depth levels deep, or with no limit if max_depth is None.
+    Those that differ are included as key: subdiff, where subdiff is the dict_diff()
+    of the two nested dicts, instead of as key: [val1, val2]. ndarray values are
+    considered equal if they have the same shape, dtype and contents, so arrays of
+    equal values but different dtypes (e.g. int and float) differ, and arrays
+    containing NaN equal identical copies of themselves."""
     diff = {}
-    for key in diff_keys:
-        diff[key] = [dict1[key], dict2[key]]
-    
+    dict1_unique = []
+    for key, value1 in dict1.items():
+        if key not in dict2:
+            dict1_unique.append(key)
+            continue
+        value2 = dict2[key]
+        if max_depth != 0 and isinstance(value1, dict) and isinstance(value2, dict):
+            subdiff = dict_diff(
+                value1, value2, None if max_depth is None else max_depth - 1
+            )
+            if subdiff:
+                diff[key] = subdiff
+        elif _values_differ(value1, value2):
+            diff[key] = [value1, value2]
+
     for key in dict1_unique:
         diff[key] = [dict1[key], '-']
-        
-    for key in dict2_unique:
-        diff[key] = ['-', dict2[key]]       
 
-    return diff
\ No newline at end of file
+    for key, value2 in dict2.items():
+        if key not in dict1:
+            diff[key] = ['-', value2]
+
+    return diff
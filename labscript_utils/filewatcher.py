@@ -14,12 +14,228 @@ from inspect import getfullargspec
 from queue import Queue, Empty
 import threading
 import os
+import sys
 import hashlib
+import select
+import struct
+import errno
+import ctypes
+import ctypes.util
+import time
+import traceback
+from stat import S_ISDIR
+
+
+# inotify event masks, from <sys/inotify.h>:
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+_INOTIFY_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+
+# Folder listings and file hashes are only reused if the folder or file was last
+# modified at least this many seconds before it was listed or hashed, since
+# modifications within the resolution of the filesystem's timestamps may not change its
+# modification time:
+LISTING_CACHE_MIN_AGE = 2
+
+# Size of reads when hashing files:
+HASH_CHUNK_SIZE = 1 << 20
+
+# struct inotify_event header: int wd; uint32_t mask, cookie, len:
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class _PollingBackend(object):
+    """Wakes the FileWatcher mainloop every interval seconds"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._stopping = Queue()
+
+    def wait(self):
+        """Block until the watched files should be checked again. Return True if
+        stop() has been called."""
+        try:
+            self._stopping.get(timeout=self.interval)
+        except Empty:
+            return False
+        return True
+
+    def sync(self, watcher):
+        """Update what is being watched to match the watcher's files and folders"""
+        pass
+
+    def stop(self):
+        self._stopping.put(None)
+
+    def close(self):
+        pass
+
+
+class _InotifyBackend(object):
+    """Wakes the FileWatcher mainloop when Linux inotify reports changes in any
+    directory containing watched files, or any watched folder or its subfolders. Once
+    changes begin, waits until there have been none for settle_time seconds, so that
+    bursts of changes result in one check. If any directory cannot be watched, for
+    example due to the inotify watch limit, also wakes every interval seconds as the
+    polling backend does."""
+
+    def __init__(self, interval, settle_time=0.05):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        self.interval = interval
+        self.settle_time = settle_time
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._inotify_add_watch = libc.inotify_add_watch
+        self._inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._inotify_rm_watch = libc.inotify_rm_watch
+        self._inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        # Pipe for stop() to wake us:
+        self._stop_read, self._stop_write = os.pipe()
+        # Directory paths to watch descriptors:
+        self.watches = {}
+        # Whether any directory could not be watched:
+        self.incomplete = False
+        # Whether directories have been watched since they were last scanned, such
+        # that files may have been created in them unseen in the meantime:
+        self.recheck = False
+        self._lock = threading.Lock()
+
+    def _read_events(self):
+        # Read all pending events, returning whether there were any:
+        any_events = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return any_events
+            any_events = True
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+                offset += _INOTIFY_EVENT.size + length
+                if mask & IN_IGNORED:
+                    # Watch was removed since the directory no longer exists:
+                    with self._lock:
+                        for path, path_wd in list(self.watches.items()):
+                            if path_wd == wd:
+                                del self.watches[path]
+
+    def wait(self):
+        if self.recheck:
+            # Check again straight away:
+            self.recheck = False
+            timeout = 0
+        elif self.incomplete:
+            timeout = self.interval
+        else:
+            timeout = None
+        readable, _, _ = select.select([self.fd, self._stop_read], [], [], timeout)
+        if self._stop_read in readable:
+            return True
+        if self._read_events():
+            # Wait for changes to settle:
+            while select.select([self.fd], [], [], self.settle_time)[0]:
+                self._read_events()
+        return False
+
+    def sync(self, watcher):
+        dirs = set(os.path.abspath(path) for path in watcher._scanned_folders)
+        # Watch the directories containing watched files and folders, or the nearest
+        # ancestor that exists if they do not, so that we see them being created:
+        parents = set(os.path.dirname(os.path.abspath(path)) for path in watcher.files)
+        parents.update(os.path.abspath(path) for path in watcher.folders)
+        for path in parents - dirs:
+            while not os.path.isdir(path) and os.path.dirname(path) != path:
+                path = os.path.dirname(path)
+            dirs.add(path)
+        incomplete = False
+        with self._lock:
+            for path in set(self.watches) - dirs:
+                self._inotify_rm_watch(self.fd, self.watches.pop(path))
+            for path in dirs - set(self.watches):
+                wd = self._inotify_add_watch(self.fd, os.fsencode(path), _INOTIFY_MASK)
+                if wd >= 0:
+                    self.watches[path] = wd
+                    # Files created in the directory after it was scanned but before
+                    # we began watching it would otherwise go unnoticed:
+                    self.recheck = True
+                elif ctypes.get_errno() not in (errno.ENOENT, errno.ENOTDIR):
+                    # Directories that no longer exist will be noticed via their
+                    # parents. Otherwise we have to fall back to polling:
+                    incomplete = True
+        self.incomplete = incomplete
+
+    def stop(self):
+        os.write(self._stop_write, b'\0')
+
+    def close(self):
+        os.close(self.fd)
+        os.close(self._stop_read)
+        os.close(self._stop_write)
+
+
+def _make_backend(backend, interval):
+    if backend == 'poll':
+        return _PollingBackend(interval)
+    elif backend == 'inotify':
+        return _InotifyBackend(interval)
+    elif backend == 'auto':
+        try:
+            return _InotifyBackend(interval)
+        except (OSError, AttributeError, TypeError):
+            # Not Linux, or no libc inotify functions:
+            return _PollingBackend(interval)
+    raise ValueError("backend must be one of 'poll', 'inotify' or 'auto'")
+
+
+def _coalesce(events):
+    """Combine a list of (name, info, event) tuples such that there is only one per
+    file, the latest, except that a file created and then modified is reported as
+    created, and one created and then deleted is not reported at all. 'original'
+    events are dropped if any file changes after them."""
+    coalesced = {}
+    for name, info, event in events:
+        previous = coalesced.pop(name, None)
+        if name != 'all':
+            coalesced.pop('all', None)
+        if previous is not None and previous[2] == 'created':
+            if event == 'deleted':
+                continue
+            elif event in ['modified', 'restored']:
+                event = 'created'
+        coalesced[name] = (name, info, event)
+    return list(coalesced.values())
 
 
 class FileWatcher(object):
     def __init__(self, callback, files=None, folders=None, clean_modified_info=None,
-                 hashable_types=None, interval=1, **kwargs):
+                 hashable_types=None, interval=1, backend='poll', batch=False,
+                 debounce=0, **kwargs):
         """
         Detect modification, deletion, creation, or restoration of specific files
         (and all files in specific folders).
@@ -40,13 +256,41 @@ class FileWatcher(object):
             clean_modified_info (dict, optional): File info to detect modification/restoration with respect
                 to. If None (default), or for files not present in clean_modified_info, the
                 initial modified info will be based on the first polling of files.
-            hashable_types (iterable, optional): File extensions for which MD5 checksum will be used to
-                detect modification/restoration with (default None). Files of any 
+            hashable_types (iterable, optional): File extensions for which an MD5 checksum
+                of the file's contents will be used to detect modification/restoration
+                with (default None). Files are only re-read to compute the checksum if
+                their size, modified time or inode changes. Files of any 
                 other type will be watched using their modified time. 
                 Restoration cannot be detected for types not in hashable_types.
             interval (float, optional): Polling interval in seconds (default 1).
+            backend (str, optional): How to detect when files may have changed.
+                'poll' (default) checks all files every interval seconds. 'inotify'
+                checks them only when Linux inotify reports changes in their
+                directories, which is immediate and uses no CPU otherwise, but does
+                not detect changes made by other computers to files on network
+                drives. 'auto' uses inotify if available, otherwise polling.
+            batch (bool, optional): If True, instead of being called once per event,
+                callback is called with a single argument: a list of
+                (name, info, event) tuples for all events since it was last called,
+                with multiple events for the same file combined into one. The callback
+                is called from a separate thread, without FileWatcher.lock held
+                (default False).
+            debounce (float, optional): In batch mode, wait until there have been no
+                further events for this many seconds before calling callback
+                (default 0).
         """
-        if len(getfullargspec(callback)[0]) > 2:
+        self.batch = batch
+        self.debounce = debounce
+        # Lists of events from each check, for the batch thread to deliver:
+        self._batches = Queue()
+        # Events from the current check:
+        self._pending = []
+        if batch:
+            self._batch_callback = callback
+            self.callback = lambda name, info, event: self._pending.append(
+                (name, info, event)
+            )
+        elif len(getfullargspec(callback)[0]) > 2:
             # For backwards compatability, allow callback to have only two args
             self.callback = callback
         else:
@@ -58,6 +302,22 @@ class FileWatcher(object):
         )
         self.files = set()
         self.folders = set()
+        # Folders and subfolders found by the most recent scan of self.folders:
+        self._scanned_folders = set()
+        # Hashes of files of hashable types, and the (size, mtime_ns, inode) at the
+        # time they were hashed, so they are only re-hashed if these change:
+        self._hashes = {}
+        # Number of bytes read to hash files, in total and during the last check():
+        self.bytes_hashed = 0
+        self.last_check_bytes_hashed = 0
+        # Folder listings, by folder, as (mtime_ns, [(path, is_dir), ...]), reused for
+        # as long as the folder's modification time is unchanged:
+        self._listings = {}
+        # os.DirEntry objects from the current scan, such that check() can reuse their
+        # stat results:
+        self._entries = {}
+        self.interval = interval
+        self._backend = self._create_backend(backend, interval)
 
         # Backwards compat for BLACS before hashing was introduced:
         if 'modified_times' in kwargs and clean_modified_info is None:
@@ -83,25 +343,62 @@ class FileWatcher(object):
         self.main = threading.Thread(target=self.mainloop)
         self.main.daemon = True
         self.running = True
-        self.interval = interval
-        self._stopping = Queue() 
+        if batch:
+            self._batch_thread = threading.Thread(target=self._batch_loop, daemon=True)
+            self._batch_thread.start()
         self.main.start()
 
+    def _create_backend(self, backend, interval):
+        return _make_backend(backend, interval)
+
     def mainloop(self):
         stopping = False
+        with self.lock:
+            self._backend.sync(self)
         while not stopping:
-            try:
-                self._stopping.get(timeout=self.interval)
-            except Empty:
-                stopping = False
-            else:
-                stopping = True
+            stopping = self._backend.wait()
             # We run one final time if stopping so that after we have stopped,
             # get_modified_info() is guaranteed to reflect any events prior to stop()
             # being called
             with self.lock:
                 self.update_files(trigger_callback=not stopping)
                 self.check(trigger_callback=not stopping)
+                if not stopping:
+                    self._backend.sync(self)
+                if self._pending:
+                    self._batches.put(self._pending)
+                    self._pending = []
+        self._backend.close()
+        if self.batch:
+            self._batches.put(None)
+
+    def _deliver(self, events):
+        try:
+            self._batch_callback(_coalesce(events))
+        except Exception:
+            # Keep delivering subsequent events:
+            traceback.print_exc()
+
+    def _batch_loop(self):
+        events = []
+        while True:
+            try:
+                # Wait indefinitely for events, or if we have some, until there have
+                # been none for the debounce time:
+                batch = self._batches.get(timeout=self.debounce if events else None)
+            except Empty:
+                self._deliver(events)
+                events = []
+                continue
+            if batch is None:
+                # Stopped:
+                if events:
+                    self._deliver(events)
+                break
+            events.extend(batch)
+            if not self.debounce:
+                self._deliver(events)
+                events = []
 
     def update_files(self, folders=None, trigger_callback=True, recursive=True):
         """Refresh the watchlist of files (FileWatcher.files) by checking the folders kwarg
@@ -109,42 +406,115 @@ class FileWatcher(object):
         """
         if folders is None:
             folders = self.folders
+            self._scanned_folders = set()
+            self._entries = {}
         for folder in folders:
-            try:
-                for name in os.listdir(folder):
-                    path = os.path.join(folder, name)
-                    # Recurse into subdirectories
-                    if recursive and os.path.isdir(path):
-                        self.update_files([path], trigger_callback)
-                    else:
-                        if not path in self.files:
-                            self.files.add(path)
-                            if trigger_callback:
-                                self.callback(
-                                    path, os.path.getmtime(path), 'created')
-            except OSError:
+            listing = self._list_folder(folder)
+            if listing is None:
                 # Folder has been deleted. File deletion will still be
                 # detected, so we can ignore this.
                 continue
+            self._scanned_folders.add(folder)
+            for path, is_dir in listing:
+                # Recurse into subdirectories
+                if recursive and is_dir:
+                    self.update_files([path], trigger_callback)
+                elif not path in self.files:
+                    self.files.add(path)
+                    if trigger_callback:
+                        try:
+                            mtime = self._stat(path).st_mtime
+                        except OSError:
+                            # Already deleted
+                            continue
+                        self.callback(path, mtime, 'created')
+
+    def _list_folder(self, folder):
+        # Return a list of (path, is_dir) for the entries in a folder, or None if it
+        # cannot be listed. If the folder's modification time is unchanged since it was
+        # last listed, the previous listing is returned without listing it again.
+        try:
+            mtime_ns = os.stat(folder).st_mtime_ns
+        except OSError:
+            self._listings.pop(folder, None)
+            return None
+        cached = self._listings.get(folder)
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1]
+        listed_at = time.time()
+        listing = []
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    listing.append((entry.path, is_dir))
+                    self._entries[entry.path] = entry
+        except OSError:
+            self._listings.pop(folder, None)
+            return None
+        if listed_at - mtime_ns / 1e9 > LISTING_CACHE_MIN_AGE:
+            self._listings[folder] = mtime_ns, listing
+        else:
+            self._listings.pop(folder, None)
+        return listing
+
+    def _stat(self, name):
+        # Return the stat result of a file, reusing that of a directory entry from the
+        # current scan if there is one:
+        entry = self._entries.get(name)
+        if entry is not None:
+            return entry.stat()
+        return os.stat(name)
+
+    def _hash_file(self, name, stat):
+        # Return the MD5 hash of the file's contents, re-hashing it only if its size,
+        # modification time or inode have changed since last hashed:
+        key = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        cached = self._hashes.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        md5 = hashlib.md5()
+        with open(name, 'rb') as f:
+            while True:
+                chunk = f.read(HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                md5.update(chunk)
+                self.bytes_hashed += len(chunk)
+                self.last_check_bytes_hashed += len(chunk)
+        file_hash = md5.hexdigest()
+        # A file modified again within the resolution of its modification time would
+        # not change its key, so only cache the hash once the file is old enough that
+        # any further writes must change its modification time:
+        if time.time() - stat.st_mtime > LISTING_CACHE_MIN_AGE:
+            self._hashes[name] = key, file_hash
+        else:
+            self._hashes.pop(name, None)
+        return file_hash
 
     def _modified_info_of_file(self, name):
         try:
             # If extension is a hashable type, use hash for modified_info
+            stat = self._stat(name)
             if os.path.splitext(name)[-1].lower() in self.hashable_types:
-                with open(name, 'rb') as f:
-                    return hashlib.md5(f.read()).hexdigest()
+                return self._hash_file(name, stat)
             # Otherwise use last modified time for modified_info
-            elif os.path.isdir(name):
+            elif S_ISDIR(stat.st_mode):
                 # Modified info of a directory is a hash of its entries:
                 entries = os.listdir(os.fsencode(name))
                 return hashlib.md5(b'\0'.join(entries)).hexdigest()
             else:
-                return os.path.getmtime(name)
+                return stat.st_mtime
         except (OSError, IOError):
             # If it doesn't exist or is inaccessible, modified info is None
+            self._hashes.pop(name, None)
             return None
 
     def check(self, trigger_callback=True):
+        self.last_check_bytes_hashed = 0
         check_all = False
         deleted_files = set()
         for name in self.files:
@@ -177,15 +547,19 @@ class FileWatcher(object):
             and trigger_callback
         ):
             self.callback('all', '', 'original')
+        # Directory entries' stat results are stale after this:
+        self._entries = {}
 
     def stop(self):
         with self.lock:
             if not self.running:
                 raise RuntimeError("Not running")
-            self._stopping.put(None)
+            self._backend.stop()
             self.running = False
         self.main.join()
         self.main = None
+        if self.batch and threading.current_thread() is not self._batch_thread:
+            self._batch_thread.join()
 
     def add_file(self, path):
         self.add_files((path,))
@@ -222,6 +596,7 @@ class FileWatcher(object):
                     self.clean_modified_info[name] = clean_modified_info[name]
                 elif name not in self.clean_modified_info:
                     self.clean_modified_info[name] = self._modified_info_of_file(name)
+            self._backend.sync(self)
 
     def add_folders(self, folders, clean_modified_info=None):
         if clean_modified_info is None:
@@ -242,6 +617,8 @@ class FileWatcher(object):
                     self.clean_modified_info[name] = clean_modified_info[name]
                 elif name not in self.clean_modified_info:
                     self.clean_modified_info[name] = self._modified_info_of_file(name)
+            self._entries = {}
+            self._backend.sync(self)
 
 
 if __name__ == '__main__':
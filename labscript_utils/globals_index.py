@@ -0,0 +1,220 @@
+"""An index of the globals of all shot files in a folder, stored in an SQLite database
+alongside them, so that shots can be found by the values of their globals without
+opening every HDF5 file. Example:
+
+.. code-block:: python
+
+    index = GlobalsIndex('/path/to/shots/2024/01/31')
+    index.update()
+    index.query('detuning', minimum=-5e6, maximum=5e6)
+    index.query('imaging_mode', 'absorption')
+    index.watch()  # keep the index up to date as shot files change
+"""
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from labscript_utils.shot_utils import get_shot_globals
+from labscript_utils.properties import serialise, deserialise
+from labscript_utils.filewatcher import FileWatcher
+
+INDEX_FILENAME = '.labscript_globals_index.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shots (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER,
+    size INTEGER
+);
+CREATE TABLE IF NOT EXISTS globals (
+    path TEXT,
+    name TEXT,
+    num REAL,
+    text TEXT,
+    value TEXT,
+    PRIMARY KEY (path, name)
+);
+CREATE INDEX IF NOT EXISTS globals_num ON globals (name, num);
+CREATE INDEX IF NOT EXISTS globals_text ON globals (name, text);
+"""
+
+# Sentinel for GlobalsIndex.query() being called without a value:
+_NO_VALUE = object()
+
+
+def _columns(value):
+    """Return the (num, text, value) columns under which a global is stored. num is
+    set for numbers and bools and text for strings, for querying. value is the
+    global serialised to JSON, or None if it cannot be."""
+    num = text = None
+    if isinstance(value, (bool, int, float, np.bool_, np.integer, np.floating)):
+        num = float(value)
+    elif isinstance(value, str):
+        text = value
+    try:
+        encoded = serialise(value)
+    except (TypeError, ValueError):
+        encoded = None
+    return num, text, encoded
+
+
+class GlobalsIndex(object):
+    """Index of the globals of all .h5 files in a folder and its subfolders, stored in
+    an SQLite database at index_file, which defaults to a file named INDEX_FILENAME
+    in the folder. The index persists between instances, and update() only re-reads
+    shot files that are new or have changed size or modification time since they
+    were last indexed. Call watch() to instead update the index incrementally in a
+    background thread as a FileWatcher detects changes. Shots that cannot be read,
+    for example because they are still being written, are skipped until they
+    change."""
+
+    def __init__(self, folder, index_file=None):
+        self.folder = os.path.abspath(folder)
+        if index_file is None:
+            index_file = os.path.join(self.folder, INDEX_FILENAME)
+        self.index_file = index_file
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(index_file, check_same_thread=False)
+        with self._db:
+            self._db.executescript(_SCHEMA)
+        self._watcher = None
+
+    def _relpath(self, path):
+        return os.path.relpath(os.path.abspath(path), self.folder)
+
+    def _remove(self, relpath):
+        self._db.execute('DELETE FROM shots WHERE path = ?', (relpath,))
+        self._db.execute('DELETE FROM globals WHERE path = ?', (relpath,))
+
+    def _index(self, relpath, stat):
+        self._remove(relpath)
+        try:
+            shot_globals = get_shot_globals(os.path.join(self.folder, relpath))
+        except (OSError, KeyError):
+            # Not readable or has no globals group, possibly still being written.
+            # Don't record it so that we try again if it changes:
+            return
+        rows = [(relpath, name) + _columns(value) for name, value in shot_globals.items()]
+        self._db.executemany('INSERT INTO globals VALUES (?, ?, ?, ?, ?)', rows)
+        self._db.execute(
+            'INSERT INTO shots VALUES (?, ?, ?)',
+            (relpath, stat.st_mtime_ns, stat.st_size),
+        )
+
+    def update(self):
+        """Bring the index up to date with the shot files in the folder"""
+        with self._lock:
+            rows = self._db.execute('SELECT path, mtime_ns, size FROM shots')
+            indexed = {path: (mtime_ns, size) for path, mtime_ns, size in rows}
+            found = set()
+            for dirpath, _, filenames in os.walk(self.folder):
+                for filename in filenames:
+                    if not filename.lower().endswith('.h5'):
+                        continue
+                    path = os.path.join(dirpath, filename)
+                    relpath = self._relpath(path)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        # Deleted since listing the folder
+                        continue
+                    found.add(relpath)
+                    if indexed.get(relpath) != (stat.st_mtime_ns, stat.st_size):
+                        self._index(relpath, stat)
+            for relpath in set(indexed) - found:
+                self._remove(relpath)
+            self._db.commit()
+
+    def update_file(self, path):
+        """Update the index for a single shot file that has been created, modified
+        or deleted"""
+        relpath = self._relpath(path)
+        with self._lock:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self._remove(relpath)
+            else:
+                row = self._db.execute(
+                    'SELECT mtime_ns, size FROM shots WHERE path = ?', (relpath,)
+                ).fetchone()
+                if row != (stat.st_mtime_ns, stat.st_size):
+                    self._index(relpath, stat)
+            self._db.commit()
+
+    def _on_file_event(self, name, info, event):
+        if event in ['created', 'modified', 'deleted', 'restored']:
+            if name.lower().endswith('.h5'):
+                self.update_file(name)
+
+    def watch(self, interval=1):
+        """Start a FileWatcher that keeps the index up to date as shot files in the
+        folder are created, modified and deleted, polling every interval seconds"""
+        if self._watcher is not None:
+            raise RuntimeError("Already watching")
+        self._watcher = FileWatcher(
+            self._on_file_event, folders=[self.folder], interval=interval
+        )
+        # Catch up on any changes prior to the watcher starting:
+        self.update()
+
+    def stop(self):
+        """Stop watching the folder for changes, if watching"""
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+    def close(self):
+        self.stop()
+        with self._lock:
+            self._db.close()
+
+    def query(self, name, value=_NO_VALUE, minimum=None, maximum=None):
+        """Return a sorted list of the paths of shots having a global called name, and
+        if value is given, with that global equal to value, or otherwise with it
+        between minimum and maximum (inclusive), if given. Numbers and bools compare
+        numerically, strings by equality, and other values by equality of their JSON
+        serialisation."""
+        sql = 'SELECT path FROM globals WHERE name = ?'
+        args = [name]
+        if value is not _NO_VALUE:
+            num, text, encoded = _columns(value)
+            if num is not None:
+                sql += ' AND num = ?'
+                args.append(num)
+            elif text is not None:
+                sql += ' AND text = ?'
+                args.append(text)
+            else:
+                sql += ' AND value = ?'
+                args.append(encoded)
+        if minimum is not None:
+            sql += ' AND num >= ?'
+            args.append(float(minimum))
+        if maximum is not None:
+            sql += ' AND num <= ?'
+            args.append(float(maximum))
+        sql += ' ORDER BY path'
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+        return [os.path.join(self.folder, relpath) for (relpath,) in rows]
+
+    def get_globals(self, path):
+        """Return the globals of a shot from the index, as get_shot_globals() would
+        from the file, except with arrays and other non-scalar values as they
+        deserialise from JSON, and those that could not be serialised as None"""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT name, value FROM globals WHERE path = ?', (self._relpath(path),)
+            ).fetchall()
+        return {
+            name: None if value is None else deserialise(value) for name, value in rows
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -12,8 +12,18 @@
 #####################################################################
 import sys
 import os
+import threading
+import logging
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, Future
+from functools import partial
+from collections import deque, namedtuple
+from fnmatch import fnmatch
+from contextlib import contextmanager
+from time import perf_counter, time
 
 from labscript_utils.ls_zprocess import Lock, connect_to_zlock_server, kill_lock
+from labscript_utils.labconfig import LabConfig
 from labscript_utils import dedent
 from labscript_utils.shared_drive import path_to_agnostic
 
@@ -36,32 +46,321 @@ if 'h5py' in sys.modules:
         
 import h5py
 
+# Name of the root group attribute marking a file as sealed, see seal():
+SEALED_ATTRIBUTE = 'sealed'
+
+_sealed_config = None
+
+# Files found to have the sealed attribute, as {normalised path: identity}, where the
+# identity is from _file_identity(). Since sealed files are never written to again, they
+# can be read without a zlock from then on - so long as the file at that path is still
+# the same one, and not, say, a new unsealed file created after deleting the old one:
+_known_sealed = {}
+_known_sealed_lock = threading.Lock()
+
+_lock_stats_lock = threading.Lock()
+_lock_stats = {'opens': 0, 'bypassed': 0, 'round_trips_avoided': 0}
+
+
+def _get_sealed_config():
+    """Return the list of path globs for files considered sealed, and whether to check
+    files for the sealed attribute, from the sealed_paths and check_sealed_attribute
+    options in the [h5_lock] section of labconfig. Both are off by default."""
+    global _sealed_config
+    if _sealed_config is not None:
+        return _sealed_config
+    labconfig = LabConfig()
+    try:
+        sealed_paths = labconfig.get('h5_lock', 'sealed_paths')
+    except (labconfig.NoOptionError, labconfig.NoSectionError):
+        sealed_paths = ''
+    # Split on commas, remove whitespace:
+    globs = [s.strip() for s in sealed_paths.split(',') if s.strip()]
+    globs = [os.path.normcase(os.path.abspath(s)) for s in globs]
+    try:
+        check_attribute = labconfig.getboolean('h5_lock', 'check_sealed_attribute')
+    except (labconfig.NoOptionError, labconfig.NoSectionError):
+        check_attribute = False
+    _sealed_config = globs, check_attribute
+    return _sealed_config
+
+
+def _normalise_path(name):
+    return os.path.normcase(os.path.abspath(os.fsdecode(name)))
+
+
+def _file_identity(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino, stat.st_mtime_ns
+
+
+def _is_sealed_path(name):
+    globs, check_attribute = _get_sealed_config()
+    if not (globs or check_attribute):
+        return False
+    path = _normalise_path(name)
+    identity = _known_sealed.get(path)
+    if identity is not None:
+        if identity == _file_identity(path):
+            return True
+        with _known_sealed_lock:
+            if _known_sealed.get(path) == identity:
+                del _known_sealed[path]
+    return any(fnmatch(path, pattern) for pattern in globs)
+
+
+def _record_if_sealed(file, name):
+    # Called with the zlock held for a file opened read-only. If it has the sealed
+    # attribute, remember it so that subsequent opens can skip the zlock:
+    try:
+        sealed = file.attrs.get(SEALED_ATTRIBUTE, False)
+    except Exception:
+        return
+    if sealed:
+        path = _normalise_path(name)
+        identity = _file_identity(path)
+        if identity is not None:
+            with _known_sealed_lock:
+                _known_sealed[path] = identity
+
+
+def _count_open(bypassed):
+    with _lock_stats_lock:
+        _lock_stats['opens'] += 1
+        if bypassed:
+            _lock_stats['bypassed'] += 1
+            # One round-trip each to acquire and release:
+            _lock_stats['round_trips_avoided'] += 2
+
+
+def get_lock_stats():
+    """Return a dict of counts, since import or the last call to reset_lock_stats(), of
+    files opened by path, how many of those were opened without a zlock because they
+    were sealed, and how many zlock server round-trips this avoided"""
+    with _lock_stats_lock:
+        return _lock_stats.copy()
+
+
+def reset_lock_stats():
+    with _lock_stats_lock:
+        for key in _lock_stats:
+            _lock_stats[key] = 0
+
+
+def seal(name):
+    """Mark a file as sealed, meaning it will not be written to again. If
+    check_sealed_attribute = True is set in the [h5_lock] section of labconfig, files
+    opened read-only are checked for this mark whilst their zlock is held, and if it is
+    present, subsequent read-only opens of the file in the same process skip the zlock.
+    Files can alternatively be declared sealed with a comma-separated list of path
+    globs in the sealed_paths option of the same section, for which read-only opens
+    skip the zlock without checking the file."""
+    with File(name, 'a') as f:
+        f.attrs[SEALED_ATTRIBUTE] = True
+
+
+LockTiming = namedtuple(
+    'LockTiming', ['time', 'path', 'mode', 'acquire_time', 'hold_time']
+)
+
+# Ring buffer of LockTimings for recently closed files, or None if not recording:
+_lock_timings = None
+
+_timing_logger_thread = None
+_timing_logger_stop = threading.Event()
+
+# Upper edges, in seconds, of the bins of the lock timing histograms:
+_TIMING_BINS = [1e-4, 1e-3, 1e-2, 1e-1, 1, 10, float('inf')]
+_TIMING_BIN_LABELS = ['<100us', '<1ms', '<10ms', '<100ms', '<1s', '<10s', '>=10s']
+
+
+def enable_lock_timing(maxlen=10000):
+    """Start recording, for each file opened by path, the time spent waiting to acquire
+    its zlock and the time it was held, in a ring buffer of the maxlen most recently
+    closed files. See get_lock_timings(), lock_timing_report() and
+    start_lock_timing_logging()."""
+    global _lock_timings
+    _lock_timings = deque(maxlen=maxlen)
+
+
+def disable_lock_timing():
+    """Stop recording lock timings and discard any recorded so far"""
+    global _lock_timings
+    _lock_timings = None
+
+
+def get_lock_timings():
+    """Return a list of LockTiming tuples for recently closed files, oldest first. Each
+    has the time.time() the file was closed, its path and mode, and the time in seconds
+    spent acquiring its zlock (zero if no zlock was required) and holding it, including
+    the time to open and close the file."""
+    timings = _lock_timings
+    if timings is None:
+        return []
+    return list(timings)
+
+
+def _histogram(values):
+    counts = [0] * len(_TIMING_BINS)
+    for value in values:
+        for i, edge in enumerate(_TIMING_BINS):
+            if value < edge:
+                counts[i] += 1
+                break
+    return counts
+
+
+def lock_timing_report(timings=None, top=10):
+    """Return a text report of the given LockTimings, or by default those returned by
+    get_lock_timings(), with histograms of lock acquire and hold times and the top
+    paths by total time spent waiting to acquire their locks"""
+    if timings is None:
+        timings = get_lock_timings()
+    lines = ['h5_lock timings for %d files' % len(timings)]
+    if not timings:
+        return lines[0]
+    acquire_counts = _histogram(t.acquire_time for t in timings)
+    hold_counts = _histogram(t.hold_time for t in timings)
+    width = max(acquire_counts + hold_counts)
+    lines.append('%8s %8s %8s' % ('', 'acquire', 'hold'))
+    for label, n_acquire, n_hold in zip(_TIMING_BIN_LABELS, acquire_counts, hold_counts):
+        bar = '#' * round(40 * n_acquire / width)
+        lines.append('%8s %8d %8d %s' % (label, n_acquire, n_hold, bar))
+    by_path = {}
+    for t in timings:
+        count, total_wait, max_wait, total_hold = by_path.get(t.path, (0, 0, 0, 0))
+        by_path[t.path] = (
+            count + 1,
+            total_wait + t.acquire_time,
+            max(max_wait, t.acquire_time),
+            total_hold + t.hold_time,
+        )
+    hotspots = sorted(by_path.items(), key=lambda item: item[1][1], reverse=True)
+    lines.append('Top paths by total acquire time:')
+    lines.append('%6s %10s %10s %10s  %s' % ('opens', 'wait', 'max wait', 'hold', 'path'))
+    for path, (count, total_wait, max_wait, total_hold) in hotspots[:top]:
+        fmt = '%6d %9.3fs %9.3fs %9.3fs  %s'
+        lines.append(fmt % (count, total_wait, max_wait, total_hold, path))
+    return '\n'.join(lines)
+
+
+def _timing_logger_loop(logger, interval):
+    last_logged = time()
+    while not _timing_logger_stop.wait(interval):
+        timings = [t for t in get_lock_timings() if t.time > last_logged]
+        if timings:
+            last_logged = timings[-1].time
+            logger.info(lock_timing_report(timings))
+
+
+def start_lock_timing_logging(interval=300, logger=None):
+    """Enable lock timing if not already enabled, and start a thread that every interval
+    seconds logs a lock_timing_report() of files closed since the last report. If logger
+    is None, logs are sent to the zlog server in the log file h5_lock.log."""
+    global _timing_logger_thread
+    if _timing_logger_thread is not None:
+        raise RuntimeError("Already logging lock timings")
+    if _lock_timings is None:
+        enable_lock_timing()
+    if logger is None:
+        from labscript_utils.setup_logging import setup_logging
+
+        logger = setup_logging('h5_lock', terminal_level=logging.WARNING)
+    _timing_logger_stop.clear()
+    _timing_logger_thread = threading.Thread(
+        target=_timing_logger_loop,
+        args=(logger, interval),
+        name='h5_lock timing logger',
+        daemon=True,
+    )
+    _timing_logger_thread.start()
+
+
+def stop_lock_timing_logging():
+    global _timing_logger_thread
+    if _timing_logger_thread is not None:
+        _timing_logger_stop.set()
+        _timing_logger_thread.join()
+        _timing_logger_thread = None
+
+
 _File = h5py.File
 class File(_File):
     def __init__(self, name, mode=None, driver=None, libver=None, **kwds):
+        # Time spent waiting for the zlock, if any:
+        self.zlock_acquire_time = 0
         if not isinstance(name, h5py._objects.ObjectID):
-            kwargs = {}
-            if mode == 'r':
-                kwargs['read_only'] = True
-            # Do not terminate upon SIGTERM while the file is open:
-            self.kill_lock = kill_lock
-            self.kill_lock.acquire()
+            self._prepare_locks(name, mode)
+            self._acquire_zlock(name, mode)
+        self._open(name, mode, driver, libver, **kwds)
+
+    def _prepare_locks(self, name, mode, own_client_id=False):
+        # Acquire the kill lock and create, but do not acquire, a zlock for the file if
+        # it needs one, with its own zlock client ID if own_client_id is True rather
+        # than that of the calling thread. Do not terminate upon SIGTERM while the file is open:
+        self.kill_lock = kill_lock
+        self.kill_lock.acquire()
+        try:
+            # Files that nobody will write to again can be read without a zlock:
+            sealed = mode == 'r' and _is_sealed_path(name)
+            _count_open(bypassed=sealed)
+            if not sealed:
+                kwargs = {}
+                if mode == 'r':
+                    kwargs['read_only'] = True
+                if own_client_id:
+                    kwargs['own_client_id'] = True
+                self.zlock = Lock(path_to_agnostic(name), **kwargs)
+        except:
+            self.kill_lock.release()
+            raise
+
+    def _acquire_zlock(self, name, mode):
+        if hasattr(self, 'zlock'):
             # Ask other zlock users not to open the file while we have it open:
-            self.zlock = Lock(path_to_agnostic(name), **kwargs)
-            self.zlock.acquire()
+            start_time = perf_counter()
+            try:
+                self.zlock.acquire()
+            except:
+                self.kill_lock.release()
+                raise
+            self.zlock_acquire_time = perf_counter() - start_time
+        self._start_lock_timing(name, mode)
+
+    def _open(self, name, mode, driver, libver, **kwds):
         try:
             _File.__init__(self, name, mode, driver, libver, **kwds)
         except:
-            if hasattr(self, 'zlock'):
-                self.zlock.release()
-            if hasattr(self, 'kill_lock'):
-                self.kill_lock.release()
+            self._release_locks()
             raise
+        if mode == 'r' and hasattr(self, 'zlock') and _get_sealed_config()[1]:
+            _record_if_sealed(self, name)
+
+    def _release_locks(self):
+        if hasattr(self, 'zlock'):
+            self.zlock.release()
+        if hasattr(self, 'kill_lock'):
+            self.kill_lock.release()
+
+    def _start_lock_timing(self, name, mode):
+        if _lock_timings is not None:
+            self._lock_timing = os.fsdecode(name), mode, perf_counter()
 
     def close(self):
         _File.close(self)
         if hasattr(self, 'zlock'):
             self.zlock.release()
+        if hasattr(self, '_lock_timing'):
+            path, mode, acquired_at = self.__dict__.pop('_lock_timing')
+            timings = _lock_timings
+            if timings is not None:
+                hold_time = perf_counter() - acquired_at
+                timings.append(
+                    LockTiming(time(), path, mode, self.zlock_acquire_time, hold_time)
+                )
         if hasattr(self, 'kill_lock'):
             self.kill_lock.release()
 
@@ -85,6 +384,152 @@ class File(_File):
         self.close()
 
 
+@contextmanager
+def open_many(paths, modes='r', **kwargs):
+    """Context manager to open several files at once, yielding a list of File objects
+    in the same order as paths. modes may be a single mode for all files, or a list of
+    modes, one per file. Any additional keyword arguments are passed to File. Files are
+    opened, and so their zlocks acquired, in a canonical order - that of their
+    OS-agnostic paths - such that two processes calling open_many() on overlapping sets
+    of files cannot deadlock. All files are closed upon exit, or if any fails to open.
+    The time spent waiting for each file's zlock is available as the
+    zlock_acquire_time attribute of each File."""
+    paths = list(paths)
+    if isinstance(modes, str):
+        modes = [modes] * len(paths)
+    else:
+        modes = list(modes)
+        if len(modes) != len(paths):
+            raise ValueError("Need one mode per path, or a single mode")
+    keys = [path_to_agnostic(os.path.abspath(path)) for path in paths]
+    if len(set(keys)) != len(keys):
+        raise ValueError("Cannot open the same file more than once")
+    order = sorted(range(len(paths)), key=keys.__getitem__)
+    files = [None] * len(paths)
+    try:
+        for i in order:
+            files[i] = File(paths[i], modes[i], **kwargs)
+        yield files
+    finally:
+        exception = None
+        for i in reversed(order):
+            if files[i] is not None:
+                try:
+                    files[i].close()
+                except Exception as e:
+                    # Close the rest before raising:
+                    exception = exception or e
+        if exception is not None:
+            raise exception
+
+
+# Maximum number of AsyncFiles that may be waiting on zlocks simultaneously. Further
+# opens queue until one of these acquires its lock:
+ASYNC_ZLOCK_WORKERS = 64
+
+_async_executors = None
+_async_executors_lock = threading.Lock()
+
+
+def _get_async_executors():
+    # Return the executors for zlock acquisition and for HDF5 operations, creating them
+    # if they do not yet exist. A single thread suffices for the latter since h5py holds
+    # a global lock for every HDF5 call anyway.
+    global _async_executors
+    with _async_executors_lock:
+        if _async_executors is None:
+            zlock_executor = ThreadPoolExecutor(
+                ASYNC_ZLOCK_WORKERS, thread_name_prefix='h5_lock zlock'
+            )
+            hdf5_executor = ThreadPoolExecutor(1, thread_name_prefix='h5_lock HDF5')
+            _async_executors = zlock_executor, hdf5_executor
+        return _async_executors
+
+
+def _submit_hdf5(fn):
+    # Submit fn to the HDF5 executor, returning a Future. If the executor has been shut
+    # down, as happens at interpreter exit, call fn in this thread instead, since it may
+    # be needed to release locks:
+    _, hdf5_executor = _get_async_executors()
+    try:
+        return hdf5_executor.submit(fn)
+    except RuntimeError:
+        future = Future()
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+def _open_for_async(name, mode, driver, libver, **kwds):
+    # Run in the zlock executor to open a File for an AsyncFile, with operations
+    # involving HDF5 run in the HDF5 executor. The zlock is acquired under a client ID
+    # of its own, since executor threads are shared by unrelated AsyncFiles:
+    file = File.__new__(File)
+    file.zlock_acquire_time = 0
+    file._prepare_locks(name, mode, own_client_id=True)
+    file._acquire_zlock(name, mode)
+    _submit_hdf5(partial(file._open, name, mode, driver, libver, **kwds)).result()
+    return file
+
+
+def _close_abandoned(future):
+    # Close a File whose AsyncFile.open() was cancelled whilst it was being opened
+    if not future.cancelled() and future.exception() is None:
+        _submit_hdf5(future.result().close)
+
+
+class AsyncFile(object):
+    """Asynchronous context manager for opening a File from asyncio code without
+    blocking the event loop. The zlock is acquired in a pool of threads, and the file
+    opened and closed in a dedicated HDF5 thread. Locking is otherwise the same as for
+    File, including holding the kill lock whilst the file is open. Arguments are as
+    for File. Usage:
+
+    .. code-block:: python
+
+        async with AsyncFile('shot.h5', 'r') as f:
+            ...
+
+    The File is also available as the file attribute, and open() and close()
+    coroutines may be awaited instead of using a context manager. Reading or writing
+    the File is not itself asynchronous, so larger reads and writes should also be
+    done in an executor."""
+
+    def __init__(self, name, mode=None, driver=None, libver=None, **kwds):
+        self.name = name
+        self.mode = mode
+        self._args = (name, mode, driver, libver)
+        self._kwds = kwds
+        self.file = None
+
+    async def open(self):
+        if self.file is not None:
+            raise RuntimeError("Already open")
+        zlock_executor, _ = _get_async_executors()
+        future = zlock_executor.submit(_open_for_async, *self._args, **self._kwds)
+        try:
+            self.file = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # The open will complete regardless if it already started, in which case
+            # close the file and release its locks once it does:
+            future.add_done_callback(_close_abandoned)
+            raise
+        return self.file
+
+    async def close(self):
+        file, self.file = self.file, None
+        if file is not None:
+            await asyncio.wrap_future(_submit_hdf5(file.close))
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
 def hack_locks_onto_h5py():
     # Monkeypatch h5py so all files are locked:
     h5py.File = File
@@ -12,6 +12,10 @@
 #####################################################################
 import sys
 import os
+import threading
+import atexit
+import itertools
+from time import monotonic
 from socket import gethostbyname
 from packaging.version import Version
 import zmq
@@ -41,6 +45,9 @@ kill_lock = KillLock()
 
 _cached_config = None
 
+# Port of the shared file watching server, see labscript_utils.shared_filewatcher:
+DEFAULT_FILEWATCHER_PORT = 7342
+
 _ERR_NO_SHARED_SECRET = """
 
 --------
@@ -94,6 +101,10 @@ def get_config():
         config['zprocess_remote_port'] = labconfig.get('ports', 'zprocess_remote')
     except (labconfig.NoOptionError, labconfig.NoSectionError):
         config['zprocess_remote_port'] = zprocess.remote.DEFAULT_PORT
+    try:
+        config['filewatcher_port'] = labconfig.getint('ports', 'filewatcher')
+    except (labconfig.NoOptionError, labconfig.NoSectionError):
+        config['filewatcher_port'] = DEFAULT_FILEWATCHER_PORT
     try:
         shared_secret_file = labconfig.get('security', 'shared_secret')
     except (labconfig.NoOptionError, labconfig.NoSectionError):
@@ -263,11 +274,218 @@ class Context(SecureContext):
         return SecureContext.socket(self, socket_type=socket_type, **kwargs)
 
 
-def Lock(*args, **kwargs):
-    if 'read_only' in kwargs and not _zlock_server_supports_readwrite:
+def Lock(key, read_only=False, own_client_id=False):
+    """Return a zlock on key. If own_client_id is True, the lock is acquired under a
+    client ID of its own rather than that of the calling thread, such that it is
+    independent of any other locks the thread holds, and may be released from any
+    thread. Read-only locks are leased if leasing is enabled, see LockLeases."""
+    if read_only and not _zlock_server_supports_readwrite:
         # Ignore read_only argument if the server does not support it:
-        del kwargs['read_only']
-    return ProcessTree.instance().lock(*args, **kwargs)
+        read_only = False
+    if _lock_leases.lease_time:
+        if read_only:
+            return LeasedLock(key)
+        # Don't hold onto any lease on the same key while waiting for a read-write
+        # lock, or we will wait for it to expire:
+        _lock_leases.expire(key)
+    if own_client_id:
+        return _OwnIdLock(ProcessTree.instance().zlock_client, key, read_only=read_only)
+    return ProcessTree.instance().lock(key, read_only=read_only)
+
+
+# Suffixes making the client IDs of _OwnIdLocks unique:
+_own_client_ids = itertools.count()
+
+
+class _OwnIdLock(zprocess.zlock.Lock):
+    """A zlock acquired under a client ID unique to this lock, rather than the client ID
+    of the calling thread"""
+
+    def acquire(self, timeout=None, read_only=None):
+        if read_only is None:
+            read_only = self.read_only
+        client = self.client
+        if not hasattr(client.local, 'sock'):
+            client._new_socket()
+        # The client acquires locks under the calling thread's client ID, so
+        # substitute ours for the duration of the request:
+        thread_client_id = client.local.client_id
+        own_client_id = b'%s:%d' % (thread_client_id, next(_own_client_ids))
+        client.local.client_id = own_client_id
+        try:
+            self._client_id = client.acquire(self.key, timeout, read_only)
+        finally:
+            client.local.client_id = thread_client_id
+
+
+class _Lease(object):
+    __slots__ = ['zlock', 'count', 'reusable_until', 'expiry']
+
+    def __init__(self, zlock, reusable_until):
+        self.zlock = zlock
+        # Number of LeasedLocks currently holding the lease:
+        self.count = 1
+        self.reusable_until = reusable_until
+        # When to release the zlock once count is zero:
+        self.expiry = None
+
+
+class LockLeases(object):
+    """Read-only zlocks that are held onto for lease_time seconds after being released,
+    such that re-acquiring them within that time does not require any round-trips to the
+    zlock server. Since a lease is shared by all threads in the process, leasing is only
+    used for read-only locks, and each lease is held under a client ID of its own rather
+    than that of any thread. Leases are not reused once they are more than half way to
+    the timeout after which the zlock server will release them. If a read-write lock for
+    the same key is requested by this process, the lease is not reused, and is released
+    as soon as no thread is using it. A thread must therefore not request a read-write
+    lock on a key whilst it holds a read-only one, as it will wait for itself until the
+    read-write request times out. Whilst a lease is
+    held, other processes must wait for it to expire to acquire a read-write lock. The
+    process-wide instance is configured with set_lock_lease_time()."""
+
+    def __init__(self, lease_time=0):
+        self.lease_time = lease_time
+        self.hits = 0
+        self.misses = 0
+        self._leases = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._expiry_thread = None
+
+    def acquire(self, key, timeout=None):
+        """Acquire a read-only lock on key, reusing an existing lease if possible, and
+        return an object to be passed to release()"""
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is not None and monotonic() < lease.reusable_until:
+                lease.count += 1
+                lease.expiry = None
+                self.hits += 1
+                return lease
+            self.misses += 1
+        zlock = _OwnIdLock(ProcessTree.instance().zlock_client, key, read_only=True)
+        zlock.acquire(timeout)
+        if timeout is None:
+            timeout = ProcessTree.instance().zlock_client.default_timeout
+        with self._lock:
+            if key in self._leases:
+                # Leave the existing lease alone, and don't lease this lock:
+                return zlock
+            lease = self._leases[key] = _Lease(zlock, monotonic() + timeout / 2)
+            return lease
+
+    def release(self, held):
+        """Release a lock returned by acquire(). If it is a lease, the zlock will not be
+        released until lease_time has elapsed without it being re-acquired, unless the
+        lease can no longer be reused, in which case it is released immediately."""
+        if not isinstance(held, _Lease):
+            held.release()
+            return
+        with self._lock:
+            held.count -= 1
+            if held.count:
+                return
+            reusable = monotonic() < held.reusable_until
+            if reusable:
+                held.expiry = monotonic() + self.lease_time
+                if self._expiry_thread is None:
+                    self._expiry_thread = threading.Thread(
+                        target=self._expiry_loop, name='zlock lease expiry', daemon=True
+                    )
+                    self._expiry_thread.start()
+            elif self._leases.get(held.zlock.key) is held:
+                del self._leases[held.zlock.key]
+        if reusable:
+            self._wakeup.set()
+        else:
+            held.zlock.release()
+
+    def _pop_idle(self, key=None, now=None):
+        # Remove and return leases no longer in use, optionally only if they have
+        # expired by time now, or only those with a given key. Caller must hold
+        # self._lock.
+        idle = []
+        for leased_key, lease in list(self._leases.items()):
+            if lease.count or key is not None and leased_key != key:
+                continue
+            if now is None or lease.expiry <= now:
+                idle.append(self._leases.pop(leased_key))
+        return idle
+
+    def expire(self, key=None):
+        """Immediately release leases that are not in use, or only that for the given
+        key if not None. Leases in use are not reused, and are released as soon as they
+        are no longer in use."""
+        with self._lock:
+            for leased_key, lease in self._leases.items():
+                if key is None or leased_key == key:
+                    lease.reusable_until = float('-inf')
+            idle = self._pop_idle(key)
+        for lease in idle:
+            lease.zlock.release()
+
+    def _expiry_loop(self):
+        while True:
+            self._wakeup.clear()
+            with self._lock:
+                now = monotonic()
+                expired = self._pop_idle(now=now)
+                pending = [l.expiry for l in self._leases.values() if not l.count]
+            for lease in expired:
+                try:
+                    lease.zlock.release()
+                except Exception:
+                    # The server may have already released it upon timeout, or be
+                    # unreachable. Either way there is nothing more to do:
+                    pass
+            self._wakeup.wait(min(pending) - now if pending else None)
+
+
+class LeasedLock(object):
+    """A read-only lock on key, acquired via leases from the process-wide LockLeases
+    instance. Has the same interface as zprocess.zlock.Lock."""
+
+    def __init__(self, key):
+        self.key = key
+        self.read_only = True
+        self._held = None
+
+    def acquire(self, timeout=None, read_only=True):
+        if not read_only:
+            raise ValueError("LeasedLock is read-only")
+        self._held = _lock_leases.acquire(self.key, timeout)
+
+    def release(self):
+        held, self._held = self._held, None
+        _lock_leases.release(held)
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+
+_lock_leases = LockLeases()
+# Don't make other processes wait for leases to time out on the server after we exit:
+atexit.register(_lock_leases.expire)
+
+
+def set_lock_lease_time(lease_time):
+    """Set how long in seconds to hold onto read-only locks after they are released, so
+    that re-acquiring them within that time is free, see LockLeases. Zero, the default,
+    disables leasing."""
+    _lock_leases.lease_time = lease_time
+    if not lease_time:
+        _lock_leases.expire()
+
+
+def get_lock_lease_stats():
+    """Return the number of read-only lock acquisitions that reused an existing lease,
+    and the number that required a round-trip to the zlock server, whilst leasing was
+    enabled"""
+    return {'hits': _lock_leases.hits, 'misses': _lock_leases.misses}
 
 
 def Event(*args, **kwargs):
@@ -1,4 +1,6 @@
 import json
+import struct
+from time import perf_counter
 from base64 import b64encode, b64decode
 from collections.abc import Iterable, Mapping
 import numpy as np
@@ -6,6 +8,18 @@ import numpy as np
 
 JSON_IDENTIFIER = 'Content-Type: application/json '
 BASE64_IDENTIFIER = 'Content-Transfer-Encoding: base64 '
+BINARY_IDENTIFIER = 'Content-Type: application/x-labscript-binary '
+BUFFER_IDENTIFIER = 'Content-Transfer-Encoding: binary '
+DATASET_IDENTIFIER = 'Content-Location: dataset '
+
+# Alignment of arrays within binary-serialised values:
+_BINARY_ALIGNMENT = 8
+
+# HDF5 attributes are limited to 64 KiB unless the file uses the latest file format.
+# Binary-serialised attributes larger than this are instead stored in a dataset in
+# BINARY_DATASETS_GROUP, with the attribute referring to it:
+BINARY_ATTRIBUTE_MAX_SIZE = 60 * 1024
+BINARY_DATASETS_GROUP = 'binary_attributes'
 
 VALID_PROPERTY_LOCATIONS = {
     "connection_table_properties",
@@ -14,39 +28,51 @@ VALID_PROPERTY_LOCATIONS = {
     }
 
 
+# Types that cannot contain dicts, which _check_dicts() need not look inside:
+_SCALAR_TYPES = (str, bytes, int, float, bool, type(None), np.generic)
+
+
 def _check_dicts(o):
     if isinstance(o, Mapping):
         if not all(isinstance(k, (str, bytes)) for k in o.keys()):
             raise TypeError("Cannot JSON encode dictionary with non-string keys")
         for item in o.values():
-            _check_dicts(item)
+            if not isinstance(item, _SCALAR_TYPES):
+                _check_dicts(item)
+    elif isinstance(o, np.ndarray):
+        # Only arrays of Python objects can contain dicts:
+        if o.dtype.hasobject:
+            for item in o.flat:
+                _check_dicts(item)
     elif isinstance(o, Iterable) and not isinstance(o, (str, bytes)):
         for item in o:
-            _check_dicts(item)
-
-
-def _encode_bytestrings(o):
-    """Encode all bytestring values (not keys) to base64 with a prefix"""
-    if isinstance(o, Mapping):
-        return {key: _encode_bytestrings(value) for key, value in o.items()}
-    elif isinstance(o, Iterable) and not isinstance(o, (str, bytes)):
-        return list([_encode_bytestrings(value) for value in o])
-    elif isinstance(o, bytes):
-        return BASE64_IDENTIFIER + str(b64encode(o).decode())
-    else:
-        return o
-
-
-def _decode_bytestrings(o):
-    """Decode all base64-encoded values (not keys) to bytestrings"""
-    if isinstance(o, Mapping):
-        return {key: _decode_bytestrings(value) for key, value in o.items()}
-    elif isinstance(o, Iterable) and not isinstance(o, (str, bytes)):
-        return list([_decode_bytestrings(value) for value in o])
-    elif isinstance(o, str) and o.startswith(BASE64_IDENTIFIER):
-        return b64decode(o[len(BASE64_IDENTIFIER):])
-    else:
-        return o
+            if not isinstance(item, _SCALAR_TYPES):
+                _check_dicts(item)
+
+
+def _decode_list(o):
+    """Decode all base64-encoded items of a list in-place to bytestrings, recursing
+    into nested lists. Nested dicts are not recursed into since _decode_dict() will
+    already have been called on them by json.loads()"""
+    for i, item in enumerate(o):
+        if isinstance(item, str):
+            if item.startswith(BASE64_IDENTIFIER):
+                o[i] = b64decode(item[len(BASE64_IDENTIFIER):])
+        elif isinstance(item, list):
+            _decode_list(item)
+    return o
+
+
+def _decode_dict(o):
+    """object_hook for json.loads() decoding all base64-encoded values (not keys) of a
+    dict in-place to bytestrings"""
+    for key, value in o.items():
+        if isinstance(value, str):
+            if value.startswith(BASE64_IDENTIFIER):
+                o[key] = b64decode(value[len(BASE64_IDENTIFIER):])
+        elif isinstance(value, list):
+            _decode_list(value)
+    return o
 
 
 def is_json(value):
@@ -58,59 +84,333 @@ def is_json(value):
 
 
 def _default(o):
-    # Workaround for https://bugs.python.org/issue24313
-    if isinstance(o, np.integer):
-        return int(o)
-    raise TypeError
+    """Convert objects that json.dumps() cannot serialise natively"""
+    if isinstance(o, bytes):
+        # Encode bytestring values (not keys) to base64 with a prefix:
+        return BASE64_IDENTIFIER + b64encode(o).decode()
+    elif isinstance(o, np.generic):
+        # numpy scalars, including numpy integers, see
+        # https://bugs.python.org/issue24313
+        return o.item()
+    elif isinstance(o, np.ndarray):
+        return o.tolist()
+    elif isinstance(o, Mapping):
+        return dict(o)
+    elif isinstance(o, Iterable):
+        return list(o)
+    msg = 'Object of type %s is not JSON serializable' % o.__class__.__name__
+    raise TypeError(msg)
 
 
 def serialise(value):
     _check_dicts(value)
-    value = _encode_bytestrings(value)
     json_string = json.dumps(value, default=_default)
     return JSON_IDENTIFIER + json_string
 
 
 def deserialise(value):
     assert is_json(value)
-    return _decode_bytestrings(json.loads(value[len(JSON_IDENTIFIER):]))
+    json_string = value[len(JSON_IDENTIFIER):]
+    identifier = BASE64_IDENTIFIER
+    if isinstance(json_string, bytes):
+        identifier = identifier.encode('utf8')
+    if identifier not in json_string:
+        # No bytestrings to decode:
+        return json.loads(json_string)
+    result = json.loads(json_string, object_hook=_decode_dict)
+    # Values not inside a dict:
+    if isinstance(result, list):
+        return _decode_list(result)
+    elif isinstance(result, str) and result.startswith(BASE64_IDENTIFIER):
+        return b64decode(result[len(BASE64_IDENTIFIER):])
+    return result
+
+
+def is_binary(value):
+    if isinstance(value, np.void):
+        value = value.tobytes()
+    if isinstance(value, bytes):
+        return value[:len(BINARY_IDENTIFIER)] == BINARY_IDENTIFIER.encode('utf8')
+    return False
+
+
+def _extract_buffers(o, buffers):
+    """Return a copy of o that json.dumps() can serialise, with ndarrays and
+    bytestrings replaced by references to them, which are appended to buffers"""
+    if isinstance(o, (str, int, float, type(None))):
+        return o
+    elif isinstance(o, bytes) or (
+        isinstance(o, np.ndarray) and not o.dtype.hasobject and o.dtype.fields is None
+    ):
+        buffers.append(o)
+        return BUFFER_IDENTIFIER + str(len(buffers) - 1)
+    elif isinstance(o, np.generic):
+        return _extract_buffers(o.item(), buffers)
+    elif isinstance(o, Mapping):
+        if not all(isinstance(k, (str, bytes)) for k in o.keys()):
+            raise TypeError("Cannot JSON encode dictionary with non-string keys")
+        return {key: _extract_buffers(value, buffers) for key, value in o.items()}
+    elif isinstance(o, np.ndarray):
+        # Arrays of objects or structured arrays:
+        return [_extract_buffers(item, buffers) for item in o.tolist()]
+    elif isinstance(o, Iterable):
+        return [_extract_buffers(item, buffers) for item in o]
+    msg = 'Object of type %s is not serializable' % o.__class__.__name__
+    raise TypeError(msg)
+
+
+def _insert_buffers(o, buffers):
+    """Inverse of _extract_buffers()"""
+    if isinstance(o, str):
+        if o.startswith(BUFFER_IDENTIFIER):
+            return buffers[int(o[len(BUFFER_IDENTIFIER):])]
+        return o
+    elif isinstance(o, dict):
+        return {key: _insert_buffers(value, buffers) for key, value in o.items()}
+    elif isinstance(o, list):
+        return [_insert_buffers(item, buffers) for item in o]
+    return o
+
+
+def serialise_binary(value):
+    """Serialise to a compact binary format, an alternative to serialise() for values
+    containing large arrays or bytestrings. Returns bytes comprising BINARY_IDENTIFIER,
+    the length of a JSON header as a little-endian uint64, the JSON header, and then
+    the raw data of all ndarrays and bytestrings in the value. The header contains
+    the value with those replaced by references to their data, and the offsets,
+    sizes, dtypes and shapes of the data."""
+    buffers = []
+    structure = _extract_buffers(value, buffers)
+    descriptions = []
+    chunks = []
+    offset = 0
+    for buffer in buffers:
+        if isinstance(buffer, bytes):
+            data = buffer
+            descriptions.append([offset, len(data)])
+        else:
+            data = buffer.tobytes()
+            descriptions.append([offset, len(data), buffer.dtype.str, buffer.shape])
+        padding = -len(data) % _BINARY_ALIGNMENT
+        chunks += [data, b'\0' * padding]
+        offset += len(data) + padding
+    identifier = BINARY_IDENTIFIER.encode('utf8')
+    header = json.dumps({'value': structure, 'buffers': descriptions}).encode('utf8')
+    # Pad the header with whitespace such that the data is aligned:
+    header += b' ' * (-(len(identifier) + 8 + len(header)) % _BINARY_ALIGNMENT)
+    return b''.join([identifier, struct.pack('<Q', len(header)), header] + chunks)
+
+
+def deserialise_binary(value):
+    """Inverse of serialise_binary(). value may be bytes or a numpy.void, as
+    returned by h5py for opaque attributes. The returned arrays share memory with a
+    single copy of value."""
+    assert is_binary(value)
+    # A writable copy with aligned data for the arrays to use as their buffer:
+    data = bytearray(value)
+    header_start = len(BINARY_IDENTIFIER.encode('utf8')) + 8
+    (header_length,) = struct.unpack_from('<Q', data, header_start - 8)
+    data_start = header_start + header_length
+    header = json.loads(data[header_start:data_start].decode('utf8'))
+    buffers = []
+    for description in header['buffers']:
+        offset, nbytes = description[:2]
+        offset += data_start
+        if len(description) == 2:
+            buffers.append(bytes(data[offset : offset + nbytes]))
+            continue
+        dtype, shape = np.dtype(description[2]), description[3]
+        if nbytes:
+            array = np.frombuffer(data, dtype, nbytes // dtype.itemsize, offset)
+            buffers.append(array.reshape(shape))
+        else:
+            buffers.append(np.empty(shape, dtype))
+    return _insert_buffers(header['value'], buffers)
+
+
+def _is_dataset_reference(value):
+    if isinstance(value, bytes):
+        return value[:len(DATASET_IDENTIFIER)] == DATASET_IDENTIFIER.encode('utf8')
+    elif isinstance(value, str):
+        return value.startswith(DATASET_IDENTIFIER)
+    return False
+
+
+def _binary_dataset_path(group, key):
+    """Path of the dataset in which a large binary-serialised attribute of the given
+    group is stored"""
+    return '/'.join(
+        [BINARY_DATASETS_GROUP] + [s for s in group.name.split('/') if s] + [key]
+    )
+
+
+def _deserialise_attribute(value, group):
+    """Deserialise a HDF5 attribute value of the given group if it was serialised as
+    JSON or binary"""
+    if is_json(value):
+        return deserialise(value)
+    elif isinstance(value, np.void) and is_binary(value):
+        return deserialise_binary(value)
+    elif _is_dataset_reference(value):
+        if isinstance(value, bytes):
+            value = value.decode('utf8')
+        dataset = group.file[value[len(DATASET_IDENTIFIER):]]
+        return deserialise_binary(dataset[()].tobytes())
+    return value
 
 
-def set_attributes(group, attributes):
+def _set_binary_attribute(group, key, value):
+    data = serialise_binary(value)
+    path = _binary_dataset_path(group, key)
+    if path in group.file:
+        # From a previous value of the attribute:
+        del group.file[path]
+    if len(data) <= BINARY_ATTRIBUTE_MAX_SIZE:
+        # Opaque HDF5 datatype:
+        group.attrs[key] = np.void(data)
+        return
+    group.file.create_dataset(path, data=np.frombuffer(data, dtype=np.uint8))
+    group.attrs[key] = DATASET_IDENTIFIER + path
+
+
+# How values of common types are stored by set_attributes(): 'native' if they map to
+# native HDF5 datatypes, 'serialise' if they do not:
+_ATTRIBUTE_TYPE_KINDS = {
+    int: 'native',
+    float: 'native',
+    bool: 'native',
+    str: 'native',
+    bytes: 'native',
+    np.int32: 'native',
+    np.int64: 'native',
+    np.float64: 'native',
+    np.bool_: 'native',
+    np.str_: 'native',
+    np.bytes_: 'native',
+    # h5py does not support None but does not raise a TypeError for it either:
+    type(None): 'serialise',
+    dict: 'serialise',
+}
+
+
+def _classify_attribute(value):
+    """Return 'native' if value maps to a native HDF5 datatype, 'serialise' if it does
+    not, or None if this can't be determined without trying to write it to a file"""
+    try:
+        return _ATTRIBUTE_TYPE_KINDS[type(value)]
+    except KeyError:
+        pass
+    if isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            return 'serialise'
+        elif value.dtype.kind in 'biufcS':
+            return 'native'
+    elif isinstance(value, Mapping):
+        return 'serialise'
+    elif isinstance(value, (int, float, str, bytes, np.number, np.bool_)):
+        return 'native'
+    return None
+
+
+def set_attributes(group, attributes, binary=False, timing_callback=None):
     """Add attributes to a HDF5 group, serialising them to JSON if they do not map to
-    native HDF5 datatypes"""
+    native HDF5 datatypes. If binary=True, serialise them with serialise_binary()
+    instead, which is more compact and faster to decode for values containing large
+    arrays or bytestrings, but is not readable by older versions of labscript_utils.
+    Binary values larger than BINARY_ATTRIBUTE_MAX_SIZE are stored in a dataset in
+    the BINARY_DATASETS_GROUP group of the file, since HDF5 limits the size of
+    attributes, with the attribute referring to the dataset.
+    Values are classified by type up front, with those mapping to native datatypes
+    written first and the rest then serialised. If timing_callback is given, it is
+    called as timing_callback(key, encoding, duration) after each attribute is
+    written, where encoding is 'native', 'json' or 'binary', and duration is the
+    time in seconds taken to serialise and write it."""
+    to_serialise = {}
     for key, val in attributes.items():
+        if _classify_attribute(val) == 'serialise':
+            to_serialise[key] = val
+            continue
+        if timing_callback is not None:
+            start_time = perf_counter()
         try:
-            # Workaround for h5py not supporting None but not raising a TypeError:
-            if val is None:
-                raise TypeError('has no native HDF5 equivalent')
             group.attrs[key] = val
         except TypeError as e:
-            # If type not supported by HDF5, store as JSON
+            # If type not supported by HDF5, store as JSON or binary
             if 'has no native HDF5 equivalent' in str(e):
-                json_string = serialise(val)
-                group.attrs[key] = json_string
-            else:
-                raise
+                to_serialise[key] = val
+                continue
+            raise
+        if timing_callback is not None:
+            timing_callback(key, 'native', perf_counter() - start_time)
+
+    encoding = 'binary' if binary else 'json'
+    for key, val in to_serialise.items():
+        if timing_callback is not None:
+            start_time = perf_counter()
+        if binary:
+            _set_binary_attribute(group, key, val)
+        else:
+            json_string = serialise(val)
+            group.attrs[key] = json_string
+        if timing_callback is not None:
+            timing_callback(key, encoding, perf_counter() - start_time)
 
 
 def get_attributes(group):
     """Return attributes of a HDF5 group as a dict, deserialising any that have been
-    encoded as JSON"""
-    return {k: deserialise(v) if is_json(v) else v for k, v in group.attrs.items()}
+    encoded as JSON or binary"""
+    return {k: _deserialise_attribute(v, group) for k, v in group.attrs.items()}
+
+
+class LazyAttributes(Mapping):
+    """Read-only mapping of the attributes of a HDF5 group, as returned by
+    get_attributes_lazy(). Each attribute is only read from the file and
+    deserialised when first accessed, and is cached thereafter. Iterating over the
+    keys does not read any values. The file must remain open whilst values not
+    already accessed are accessed."""
+
+    def __init__(self, group):
+        self._group = group
+        self._attrs = group.attrs
+        self._cache = {}
+
+    def __getitem__(self, name):
+        try:
+            return self._cache[name]
+        except KeyError:
+            pass
+        value = _deserialise_attribute(self._attrs[name], self._group)
+        self._cache[name] = value
+        return value
+
+    def __contains__(self, name):
+        return name in self._cache or name in self._attrs
+
+    def __iter__(self):
+        return iter(self._attrs)
+
+    def __len__(self):
+        return len(self._attrs)
+
+    def __repr__(self):
+        return '<%s of %d attributes>' % (self.__class__.__name__, len(self))
+
+
+def get_attributes_lazy(group):
+    """Like get_attributes(), but return a LazyAttributes mapping that reads and
+    deserialises each attribute only when it is accessed, for when only some of the
+    attributes of a group with many are needed."""
+    return LazyAttributes(group)
 
 
 def get_attribute(group, name):
     """Return the attribute of the given name from the given HDF5 group, deserialising
-    it if it has been encoded as JSON"""
-    value = group.attrs[name]
-    if is_json(value):
-        return deserialise(value)
-    return value
+    it if it has been encoded as JSON or binary"""
+    return _deserialise_attribute(group.attrs[name], group)
 
 
-def set_device_properties(h5_file, device_name, properties):
-    set_attributes(h5_file['devices/' + device_name], properties)
+def set_device_properties(h5_file, device_name, properties, binary=False):
+    set_attributes(h5_file['devices/' + device_name], properties, binary=binary)
 
 
 def _get_device_properties(h5_file, device_name):
@@ -133,6 +433,60 @@ def _get_unit_conversion_parameters(h5_file, device_name):
     return deserialise(json_string)
 
 
+# Columns of the connection table that each location other than 'device_properties'
+# corresponds to:
+_CONNECTION_TABLE_COLUMNS = {
+    'connection_table_properties': 'properties',
+    'unit_conversion_parameters': 'unit conversion params',
+}
+
+
+def get_many(h5_file, device_names, location):
+    """Return a dict of {device_name: properties} for the given devices, as would be
+    returned by calling get() for each one. For locations in the connection table,
+    the table is read only once, rather than once per device. Raises KeyError if a
+    device is not in the connection table."""
+    if location == 'device_properties':
+        return {name: _get_device_properties(h5_file, name) for name in device_names}
+    elif location in _CONNECTION_TABLE_COLUMNS:
+        dataset = h5_file['connection table']
+        names = dataset['name']
+        values = dataset[_CONNECTION_TABLE_COLUMNS[location]]
+        # Index of the first row with each name:
+        rows = {}
+        for i, name in enumerate(names):
+            rows.setdefault(name, i)
+        properties = {}
+        for device_name in device_names:
+            try:
+                row = rows[device_name.encode('utf8')]
+            except KeyError:
+                msg = 'device %s not in connection table' % device_name
+                raise KeyError(msg) from None
+            properties[device_name] = deserialise(values[row])
+        return properties
+    else:
+        raise ValueError('location must be one of %s'%str(VALID_PROPERTY_LOCATIONS))
+
+
+def get_all(h5_file, location):
+    """Return a dict of {device_name: properties} for all devices, for the given
+    location. For 'device_properties' this is all devices with a group in the
+    'devices' group of the file, otherwise it is all devices in the connection
+    table."""
+    if location == 'device_properties':
+        device_names = list(h5_file['devices'].keys()) if 'devices' in h5_file else []
+    elif location in _CONNECTION_TABLE_COLUMNS:
+        names = h5_file['connection table']['name']
+        device_names = [
+            name.decode('utf8') if isinstance(name, bytes) else str(name)
+            for name in names
+        ]
+    else:
+        raise ValueError('location must be one of %s'%str(VALID_PROPERTY_LOCATIONS))
+    return get_many(h5_file, device_names, location)
+
+
 def get(h5_file, device_name, location):
     if location == 'device_properties':
         return _get_device_properties(h5_file, device_name)
@@ -0,0 +1,441 @@
+#####################################################################
+#                                                                   #
+# shared_filewatcher.py                                             #
+#                                                                   #
+# Copyright 2013, Monash University                                 #
+#                                                                   #
+# This file is part of the labscript suite (see                     #
+# http://labscriptsuite.org) and is licensed under the Simplified   #
+# BSD License. See the license.txt file in the root of the project  #
+# for the full license.                                             #
+#                                                                   #
+#####################################################################
+"""A server that watches files on behalf of all labscript programs on this computer,
+such that files watched by several programs are only polled once, and a FileWatcher
+subclass, SharedFileWatcher, that receives change events from it instead of polling.
+Run the server with:
+
+.. code-block:: bash
+
+    python -m labscript_utils.shared_filewatcher [--daemon]
+
+If --daemon is specified, the server will be started in the background.
+SharedFileWatcher starts the server in the background automatically if it is not
+running. The server polls files as FileWatcher does by default, or uses inotify if
+labconfig has ``backend = inotify`` or ``backend = auto`` in a ``[filewatcher]``
+section, and the polling interval can be set there with ``interval``.
+"""
+import sys
+import os
+import pickle
+import threading
+from stat import S_ISDIR
+
+import zmq
+from zprocess import start_daemon
+
+from labscript_utils.ls_zprocess import ZMQServer, Context, get_config, zmq_get
+from labscript_utils.labconfig import LabConfig
+from labscript_utils.filewatcher import FileWatcher
+
+# A message subscribers can use to confirm their subscription has been processed:
+WELCOME_MESSAGE = b'_filewatcher_hello\0'
+
+# Timeout for requests to the server. Adding folders can involve listing and hashing
+# many files, so this is generous:
+REQUEST_TIMEOUT = 30
+
+
+class _ServerWatcher(FileWatcher):
+    """FileWatcher whose modified info for each file is a tuple of its modified time
+    and, for hashable types, its hash, such that each client can use whichever its own
+    hashable_types calls for. Directories have a hash of their entries in place of
+    their modified time."""
+
+    def _modified_info_of_file(self, name):
+        try:
+            stat = self._stat(name)
+            if S_ISDIR(stat.st_mode):
+                return FileWatcher._modified_info_of_file(self, name), None
+            elif os.path.splitext(name)[-1].lower() in self.hashable_types:
+                return stat.st_mtime, self._hash_file(name, stat)
+            else:
+                return stat.st_mtime, None
+        except (OSError, IOError):
+            self._hashes.pop(name, None)
+            return None
+
+
+class FileWatcherServer(ZMQServer):
+    """Server watching the files and folders requested by clients, and publishing
+    (seq, name, info) on a zmq PUB socket whenever a file's modified info changes,
+    where info is as returned by _ServerWatcher._modified_info_of_file(), and seq
+    increases by one with each message. Each client identifies itself with a client ID,
+    and files and folders remain watched until every client that asked to watch them
+    has sent an unwatch request."""
+
+    def __init__(self, port, interval=1, backend='poll'):
+        context = Context.instance()
+        self.pub = context.socket(zmq.XPUB)
+        # Clients are only on this computer, so only publish to it:
+        self.pub_port = self.pub.bind_to_random_port('tcp://127.0.0.1')
+        # The watcher's batch thread sends events to the publishing thread over this
+        # pair of sockets, since only one thread may use the PUB socket:
+        self._pull = context.socket(zmq.PULL)
+        self._pull.bind('inproc://filewatcher-%d' % id(self))
+        self._push = context.socket(zmq.PUSH)
+        self._push.connect('inproc://filewatcher-%d' % id(self))
+        self._seq = 0
+        # Files and folders each client has asked to watch, as {client_id: (files,
+        # folders)}:
+        self._watches = {}
+        self.watcher = _ServerWatcher(
+            self._on_events, interval=interval, backend=backend, batch=True
+        )
+        self._pub_thread = threading.Thread(target=self._pub_loop, daemon=True)
+        self._pub_thread.start()
+        ZMQServer.__init__(self, port, bind_address='tcp://127.0.0.1')
+
+    def _pub_loop(self):
+        poller = zmq.Poller()
+        poller.register(self.pub, zmq.POLLIN)
+        poller.register(self._pull, zmq.POLLIN)
+        while True:
+            events = dict(poller.poll())
+            if self.pub in events:
+                msg = self.pub.recv()
+                is_subscription, topic = ord(msg[0:1]), msg[1:]
+                if is_subscription and topic.startswith(WELCOME_MESSAGE):
+                    # A new subscriber asking for a welcome message to confirm that
+                    # its subscriptions have been processed:
+                    self.pub.send(topic)
+            if self._pull in events:
+                msg = self._pull.recv_multipart()
+                if len(msg) == 1:
+                    # Shutting down:
+                    break
+                self.pub.send_multipart(msg)
+        self.pub.close(linger=0)
+        self._pull.close(linger=0)
+
+    def _on_events(self, events):
+        # Publish the current modified info of each file with events, reading it
+        # under the lock such that it is consistent with the sequence number:
+        with self.watcher.lock:
+            for name, _, event in events:
+                if event == 'original':
+                    continue
+                self._seq += 1
+                info = self.watcher.modified_info.get(name)
+                self._push.send_multipart(
+                    [os.fsencode(name) + b'\0', pickle.dumps((self._seq, name, info))]
+                )
+
+    def watch(self, client_id, files, folders, hashable_types):
+        """Start watching the given files and folders on behalf of the given client if
+        not already watching them, and return the current sequence number and the
+        modified info of the files and of all files in the folders"""
+        watcher = self.watcher
+        with watcher.lock:
+            client_files, client_folders = self._watches.setdefault(
+                client_id, (set(), set())
+            )
+            client_files.update(files)
+            client_folders.update(folders)
+            new_types = {t.lower() for t in hashable_types}
+            new_types -= set(watcher.hashable_types)
+            if new_types:
+                watcher.hashable_types.extend(sorted(new_types))
+                # Add hashes to the modified info of already-watched files of the new
+                # types, keeping their modified times such that any change since they
+                # were last checked is still detected by the next check:
+                for name, info in watcher.modified_info.items():
+                    if info is None or info[1] is not None:
+                        continue
+                    if os.path.splitext(name)[-1].lower() in new_types:
+                        new_info = watcher._modified_info_of_file(name)
+                        if new_info is not None:
+                            watcher.modified_info[name] = info[0], new_info[1]
+            new_files = set(files) - watcher.files
+            new_folders = set(folders) - watcher.folders
+        if new_files:
+            watcher.add_files(new_files)
+        if new_folders:
+            watcher.add_folders(new_folders)
+        with watcher.lock:
+            for name in watcher.files:
+                if name not in watcher.modified_info:
+                    watcher.modified_info[name] = watcher.clean_modified_info.get(name)
+            modified_info = {name: watcher.modified_info.get(name) for name in files}
+            prefixes = tuple(os.path.join(folder, '') for folder in folders)
+            if prefixes:
+                for name in watcher.files:
+                    if name.startswith(prefixes):
+                        modified_info[name] = watcher.modified_info[name]
+            return {'seq': self._seq, 'modified_info': modified_info}
+
+    def unwatch(self, client_id):
+        """Forget the files and folders the given client asked to watch, and stop
+        watching those that no other client has asked to watch"""
+        watcher = self.watcher
+        with watcher.lock:
+            if self._watches.pop(client_id, None) is None:
+                return
+            files = set()
+            folders = set()
+            for client_files, client_folders in self._watches.values():
+                files.update(client_files)
+                folders.update(client_folders)
+            watcher.folders = folders
+            prefixes = tuple(os.path.join(folder, '') for folder in folders)
+
+            def still_watched(name):
+                return name in files or name in folders or name.startswith(prefixes)
+
+            for name in list(watcher.files):
+                if not still_watched(name):
+                    watcher.files.remove(name)
+                    watcher.modified_info.pop(name, None)
+                    watcher.clean_modified_info.pop(name, None)
+                    watcher._hashes.pop(name, None)
+            watcher._scanned_folders = set(filter(still_watched, watcher._scanned_folders))
+            watcher._listings = {
+                folder: listing
+                for folder, listing in watcher._listings.items()
+                if still_watched(folder)
+            }
+            watcher._entries = {}
+            watcher._backend.sync(watcher)
+
+    def handler(self, request):
+        command, args = request[0], request[1:]
+        if command == 'hello':
+            return 'hello'
+        elif command == 'info':
+            return {'pub_port': self.pub_port}
+        elif command == 'watch':
+            return self.watch(*args)
+        elif command == 'unwatch':
+            return self.unwatch(*args)
+        raise ValueError("Unknown command %r" % (command,))
+
+    def shutdown(self):
+        ZMQServer.shutdown(self)
+        self.watcher.stop()
+        # The watcher's batch thread has finished with the PUSH socket, so we can use
+        # it to stop the publishing thread:
+        self._push.send(b'')
+        self._pub_thread.join()
+        self._push.close(linger=0)
+
+
+def connect_to_filewatcher_server():
+    """Ensure a FileWatcherServer is running on this computer, starting one if not,
+    and return its port"""
+    port = get_config()['filewatcher_port']
+    try:
+        # Short timeout, since it's on localhost:
+        zmq_get(port, 'localhost', data=('hello',), timeout=0.05)
+    except zmq.ZMQError:
+        # Not running. Start it. It will run forever, even after this program exits,
+        # since other programs may be using it:
+        start_daemon([sys.executable, '-m', 'labscript_utils.shared_filewatcher'])
+        # Try again. Longer timeout this time, give it time to start up:
+        zmq_get(port, 'localhost', data=('hello',), timeout=15)
+    return port
+
+
+class _SubscriptionBackend(object):
+    """Wakes the SharedFileWatcher mainloop when the server publishes changes"""
+
+    def __init__(self, port):
+        self.port = port
+        pub_port = zmq_get(port, 'localhost', data=('info',))['pub_port']
+        self.sub = Context.instance().socket(zmq.SUB)
+        self.sub.setsockopt(zmq.SUBSCRIBE, b'')
+        self.sub.connect('tcp://127.0.0.1:%d' % pub_port)
+        # Wait for confirmation that the server has processed our subscription, so
+        # that we receive all changes after any snapshot we subsequently request:
+        welcome = WELCOME_MESSAGE + os.urandom(32)
+        self.sub.setsockopt(zmq.SUBSCRIBE, welcome)
+        while True:
+            if not self.sub.poll(timeout=5000):
+                self.sub.close(linger=0)
+                raise TimeoutError("Could not subscribe to filewatcher server")
+            if self.sub.recv_multipart() == [welcome]:
+                break
+        self.sub.setsockopt(zmq.UNSUBSCRIBE, welcome)
+        # stop() sends to this socket to interrupt wait(). A zmq socket rather than a
+        # pipe, since on Windows zmq can only poll sockets:
+        self._stop_endpoint = 'inproc://filewatcher-stop-%d' % id(self)
+        self._stop_sock = Context.instance().socket(zmq.PULL)
+        self._stop_sock.bind(self._stop_endpoint)
+        self.poller = zmq.Poller()
+        self.poller.register(self.sub, zmq.POLLIN)
+        self.poller.register(self._stop_sock, zmq.POLLIN)
+        self._updates = []
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until the server publishes changes. Return True if stop() has been
+        called."""
+        events = dict(self.poller.poll())
+        if self._stop_sock in events:
+            return True
+        updates = []
+        while True:
+            try:
+                msg = self.sub.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            if len(msg) == 2:
+                updates.append(pickle.loads(msg[1]))
+        with self._lock:
+            self._updates.extend(updates)
+        return False
+
+    def take_updates(self):
+        """Return and clear the list of (seq, name, info) received from the server"""
+        with self._lock:
+            updates, self._updates = self._updates, []
+        return updates
+
+    def sync(self, watcher):
+        pass
+
+    def stop(self):
+        sock = Context.instance().socket(zmq.PUSH)
+        sock.connect(self._stop_endpoint)
+        sock.send(b'stop')
+        sock.close(linger=100)
+
+    def close(self):
+        self.sub.close(linger=0)
+        self._stop_sock.close(linger=0)
+
+
+class SharedFileWatcher(FileWatcher):
+    """FileWatcher that receives changes from a FileWatcherServer running on this
+    computer instead of polling files itself, starting the server if it is not
+    running. Arguments, callbacks and events are as for FileWatcher, except that
+    interval and backend are ignored, since the server decides how files are
+    watched. Call stop() when done, so that the server can stop watching files that no
+    other client is watching."""
+
+    def __init__(self, *args, **kwargs):
+        self._port = connect_to_filewatcher_server()
+        # Identifies us to the server, which keeps track of what each client watches:
+        self._client_id = os.urandom(16).hex()
+        # Latest (seq, info) from the server for each file, by absolute path:
+        self._server_info = {}
+        FileWatcher.__init__(self, *args, **kwargs)
+
+    def _create_backend(self, backend, interval):
+        return _SubscriptionBackend(self._port)
+
+    def _watch(self, files=(), folders=()):
+        # Ask the server to watch files and folders, and record its modified info for
+        # them:
+        request = (
+            'watch',
+            self._client_id,
+            [os.path.abspath(name) for name in files],
+            [os.path.abspath(folder) for folder in folders],
+            self.hashable_types,
+        )
+        response = zmq_get(
+            self._port, 'localhost', data=request, timeout=REQUEST_TIMEOUT
+        )
+        with self.lock:
+            self._apply_updates()
+            seq = response['seq']
+            for name, info in response['modified_info'].items():
+                if self._server_info.get(name, (-1, None))[0] < seq:
+                    self._server_info[name] = seq, info
+
+    def _apply_updates(self):
+        prefixes = tuple(os.path.join(os.path.abspath(f), '') for f in self.folders)
+        for seq, name, info in self._backend.take_updates():
+            previous = self._server_info.get(name)
+            if previous is None:
+                # Ignore files that other clients are watching:
+                if not (prefixes and name.startswith(prefixes)):
+                    continue
+            elif previous[0] >= seq:
+                # Already have newer info from a snapshot:
+                continue
+            self._server_info[name] = seq, info
+
+    def _modified_info_of_file(self, name):
+        _, info = self._server_info.get(os.path.abspath(name), (None, None))
+        if info is None:
+            return None
+        mtime, file_hash = info
+        if file_hash is not None:
+            if os.path.splitext(name)[-1].lower() in self.hashable_types:
+                return file_hash
+        return mtime
+
+    def update_files(self, folders=None, trigger_callback=True, recursive=True):
+        """Refresh the watchlist of files (FileWatcher.files) from the files the server
+        has reported in the folders kwarg, or FileWatcher.folders if this is not
+        specified.
+        """
+        self._apply_updates()
+        if folders is None:
+            folders = self.folders
+        for folder in folders:
+            prefix = os.path.join(os.path.abspath(folder), '')
+            for name, (_, info) in self._server_info.items():
+                if info is None or not name.startswith(prefix):
+                    continue
+                relpath = name[len(prefix) :]
+                if not recursive and os.sep in relpath:
+                    continue
+                path = os.path.join(folder, relpath)
+                if not path in self.files:
+                    self.files.add(path)
+                    if trigger_callback:
+                        self.callback(path, info[0], 'created')
+
+    def stop(self):
+        FileWatcher.stop(self)
+        # Tell the server we no longer need our files watched. Short timeout, since
+        # it's on localhost, and if it is not running there is nothing to unwatch:
+        try:
+            zmq_get(self._port, 'localhost', data=('unwatch', self._client_id), timeout=5)
+        except TimeoutError:
+            pass
+
+    def add_files(self, files, clean_modified_info=None):
+        self._watch(files=files)
+        FileWatcher.add_files(self, files, clean_modified_info)
+
+    def add_folders(self, folders, clean_modified_info=None):
+        self._watch(folders=folders)
+        FileWatcher.add_folders(self, folders, clean_modified_info)
+
+
+def main():
+    config = get_config()
+    labconfig = LabConfig()
+    try:
+        backend = labconfig.get('filewatcher', 'backend')
+    except (labconfig.NoOptionError, labconfig.NoSectionError):
+        backend = 'poll'
+    try:
+        interval = labconfig.getfloat('filewatcher', 'interval')
+    except (labconfig.NoOptionError, labconfig.NoSectionError):
+        interval = 1
+
+    if '--daemon' in sys.argv:
+        start_daemon([sys.executable, '-m', 'labscript_utils.shared_filewatcher'])
+    else:
+        server = FileWatcherServer(
+            config['filewatcher_port'], interval=interval, backend=backend
+        )
+        server.shutdown_on_interrupt()
+
+
+if __name__ == '__main__':
+    main()
@@ -11,27 +11,143 @@
 #                                                                   #
 #####################################################################
 
+import os
+import sys
+import threading
+import importlib
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import h5py
 import numpy as np
 
+# Types of globals that need no conversion by get_shot_globals(), for a fast path:
+_UNCONVERTED_TYPES = {float, int, str, np.float64, np.int64, np.ndarray}
+
+# Cache of globals read by get_shot_globals_many(), keyed by (path, mtime, size):
+_globals_cache = OrderedDict()
+_globals_cache_lock = threading.Lock()
+GLOBALS_CACHE_SIZE = 10000
+
+
+def _convert_global(value):
+    if type(value) in _UNCONVERTED_TYPES:
+        return value
+    # Convert numpy bools to normal bools:
+    if isinstance(value, np.bool_):
+        value = bool(value)
+    # Convert null HDF references to None:
+    if isinstance(value, h5py.Reference) and not value:
+        value = None
+    # Convert numpy strings to Python ones.
+    # DEPRECATED, for backward compat with old files.
+    if isinstance(value, np.str_):
+        value = str(value)
+    if isinstance(value, bytes):
+        value = value.decode()
+    return value
+
+
 def get_shot_globals(filepath):
     """Returns the evaluated globals for a shot, for use by labscript or lyse.
     Simple dictionary access as in dict(h5py.File(filepath).attrs) would be fine
     except we want to apply some hacks, so it's best to do that in one place."""
-    params = {}
     with h5py.File(filepath, 'r') as f:
-        for name, value in f['globals'].attrs.items():
-            # Convert numpy bools to normal bools:
-            if isinstance(value, np.bool_):
-                value = bool(value)
-            # Convert null HDF references to None:
-            if isinstance(value, h5py.Reference) and not value:
-                value = None
-            # Convert numpy strings to Python ones.
-            # DEPRECATED, for backward compat with old files.
-            if isinstance(value, np.str_):
-                value = str(value)
-            if isinstance(value, bytes):
-                value = value.decode()
-            params[name] = value
-    return params
\ No newline at end of file
+        return {
+            name: _convert_global(value) for name, value in f['globals'].attrs.items()
+        }
+
+
+def _cache_key(filepath):
+    stat = os.stat(filepath)
+    return (os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size)
+
+
+def _globals_table(results):
+    """Return a numpy record array with a field for each global in any of the given
+    dicts of globals, and a record for each dict. Fields have the dtype numpy infers
+    from their values, or object if the values are not scalars or if any dict is
+    missing that global, in which case its value is None."""
+    names = list(OrderedDict.fromkeys(name for result in results for name in result))
+    columns = []
+    for name in names:
+        values = [result.get(name) for result in results]
+        column = None
+        if all(name in result for result in results):
+            try:
+                column = np.array(values)
+            except ValueError:
+                # Values of inhomogeneous shapes
+                pass
+        if column is None or column.shape != (len(values),):
+            column = np.empty(len(values), dtype=object)
+            column[:] = values
+        columns.append(column)
+    if not names:
+        return np.rec.array(np.empty(len(results), dtype=[]))
+    return np.rec.fromarrays(columns, names=names)
+
+
+def _process_pool(max_workers):
+    """Return a ProcessPoolExecutor for reading shot files. Processes are spawned
+    rather than forked, since the zmq sockets and zlock client state of this process
+    cannot be used from a forked child. If this process uses h5_lock, the workers
+    import it before anything else, so that they too lock files, with their own
+    connection to the zlock server."""
+    kwargs = {}
+    if 'labscript_utils.h5_lock' in sys.modules:
+        kwargs['initializer'] = importlib.import_module
+        kwargs['initargs'] = ('labscript_utils.h5_lock',)
+    return ProcessPoolExecutor(
+        max_workers, mp_context=multiprocessing.get_context('spawn'), **kwargs
+    )
+
+
+def get_shot_globals_many(
+    filepaths, max_workers=None, use_processes=False, as_table=False
+):
+    """Return the globals of many shots, as get_shot_globals() would for each one.
+    Results are cached in memory, keyed by each file's path, modification time and
+    size, such that files that have not changed are not re-read if this function is
+    called again. Files not in the cache are read concurrently by a pool of
+    max_workers threads, or processes if use_processes=True. Returns a list of dicts
+    of globals in the same order as filepaths, or if as_table=True, a numpy record
+    array with a record per shot and a field per global."""
+    keys = [_cache_key(filepath) for filepath in filepaths]
+    results = [None] * len(keys)
+    to_read = {}
+    with _globals_cache_lock:
+        for i, key in enumerate(keys):
+            if key in _globals_cache:
+                _globals_cache.move_to_end(key)
+                results[i] = _globals_cache[key]
+            else:
+                to_read.setdefault(key, []).append(i)
+
+    if len(to_read) == 1:
+        [key] = to_read
+        read_results = [get_shot_globals(key[0])]
+    elif to_read:
+        if use_processes:
+            executor = _process_pool(max_workers)
+        else:
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+        with executor:
+            read_results = list(
+                executor.map(get_shot_globals, [key[0] for key in to_read])
+            )
+    else:
+        read_results = []
+
+    with _globals_cache_lock:
+        for (key, indices), result in zip(to_read.items(), read_results):
+            _globals_cache[key] = result
+            for i in indices:
+                results[i] = result
+        while len(_globals_cache) > GLOBALS_CACHE_SIZE:
+            _globals_cache.popitem(last=False)
+
+    if as_table:
+        return _globals_table(results)
+    # Copies so that callers modifying them don't modify the cache:
+    return [dict(result) for result in results]
@@ -0,0 +1,2 @@
+# h5_lock must be imported before h5py:
+import labscript_utils.h5_lock
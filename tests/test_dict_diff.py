@@ -0,0 +1,48 @@
+import numpy as np
+
+from labscript_utils.dict_diff import dict_diff
+
+
+def test_unique_and_differing_keys():
+    diff = dict_diff({'a': 1, 'b': 2, 'c': 3}, {'b': 2, 'c': 4, 'd': 5})
+    assert diff == {'a': [1, '-'], 'c': [3, 4], 'd': ['-', 5]}
+
+
+def test_array_dtypes_differ():
+    int_array = np.array([1, 2, 3])
+    float_array = np.array([1.0, 2.0, 3.0])
+    diff = dict_diff({'x': int_array}, {'x': float_array})
+    assert list(diff) == ['x']
+    assert diff['x'][0] is int_array and diff['x'][1] is float_array
+
+
+def test_nan_arrays_equal():
+    assert dict_diff({'x': np.array([1.0, np.nan])}, {'x': np.array([1.0, np.nan])}) == {}
+
+
+def test_array_shapes_and_values_differ():
+    assert 'x' in dict_diff({'x': np.zeros(3)}, {'x': np.zeros(4)})
+    assert 'x' in dict_diff({'x': np.zeros(3)}, {'x': np.ones(3)})
+    assert dict_diff({'x': np.arange(3)}, {'x': np.arange(3)}) == {}
+
+
+def test_lists_of_arrays():
+    assert dict_diff({'x': [np.zeros(2)]}, {'x': [np.zeros(2)]}) == {}
+    assert 'x' in dict_diff({'x': [np.zeros(2)]}, {'x': [np.ones(2)]})
+
+
+def test_max_depth():
+    dict1 = {'outer': {'inner': {'a': 1}, 'b': 2}}
+    dict2 = {'outer': {'inner': {'a': 3}, 'b': 2}}
+    # Default: nested dicts compared as values:
+    assert dict_diff(dict1, dict2) == {'outer': [dict1['outer'], dict2['outer']]}
+    # One level of recursion:
+    assert dict_diff(dict1, dict2, max_depth=1) == {
+        'outer': {'inner': [{'a': 1}, {'a': 3}]}
+    }
+    # Unlimited recursion:
+    assert dict_diff(dict1, dict2, max_depth=None) == {
+        'outer': {'inner': {'a': [1, 3]}}
+    }
+    # Equal nested dicts are not reported at any depth:
+    assert dict_diff(dict1, dict1, max_depth=None) == {}
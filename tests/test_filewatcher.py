@@ -0,0 +1,57 @@
+import os
+import sys
+import hashlib
+import threading
+
+import pytest
+
+from labscript_utils.filewatcher import FileWatcher, _InotifyBackend
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="requires inotify")
+def test_inotify_file_created_before_new_directory_watched(tmp_path):
+    subdir = tmp_path / 'subdir'
+    created = tmp_path / 'subdir' / 'new.txt'
+
+    class RacingBackend(_InotifyBackend):
+        def sync(self, watcher):
+            # Create a file in the new directory after it has been scanned, but before
+            # it is watched:
+            if str(subdir) in watcher._scanned_folders and not created.exists():
+                created.write_text('hello')
+            super().sync(watcher)
+
+    class RacingWatcher(FileWatcher):
+        def _create_backend(self, backend, interval):
+            return RacingBackend(interval)
+
+    events = []
+    event_received = threading.Event()
+
+    def callback(name, info, event):
+        events.append((name, event))
+        if name == str(created):
+            event_received.set()
+
+    watcher = RacingWatcher(callback, folders=[str(tmp_path)], interval=60)
+    try:
+        os.mkdir(subdir)
+        assert event_received.wait(5)
+    finally:
+        watcher.stop()
+    assert (str(created), 'created') in events
+
+
+def test_hash_not_cached_while_file_recently_modified(tmp_path):
+    path = tmp_path / 'data.txt'
+    path.write_bytes(b'original')
+    watcher = FileWatcher(lambda *args: None, files=[str(path)], hashable_types=['.txt'])
+    try:
+        # Rewrite the file keeping the same size and modification time, as a write
+        # within the resolution of the filesystem's timestamps might:
+        stat = os.stat(path)
+        path.write_bytes(b'modified')
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert watcher._modified_info_of_file(str(path)) == hashlib.md5(b'modified').hexdigest()
+    finally:
+        watcher.stop()
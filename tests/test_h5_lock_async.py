@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+import labscript_utils.h5_lock as h5_lock
+from labscript_utils.ls_zprocess import kill_lock
+import h5py
+
+
+@pytest.fixture
+def executors(request):
+    """Replace the AsyncFile executors with ones with the given number of zlock
+    workers, and restore the defaults afterwards"""
+
+    def make(workers):
+        request.addfinalizer(reset)
+        h5_lock.ASYNC_ZLOCK_WORKERS = workers
+        return h5_lock._get_async_executors()
+
+    def reset():
+        if h5_lock._async_executors is not None:
+            for executor in h5_lock._async_executors:
+                executor.shutdown()
+        h5_lock._async_executors = None
+        h5_lock.ASYNC_ZLOCK_WORKERS = default_workers
+
+    default_workers = h5_lock.ASYNC_ZLOCK_WORKERS
+    reset()
+    return make
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'test.h5')
+    with h5py.File(path, 'w') as f:
+        f.attrs['count'] = 0
+    return path
+
+
+async def assert_waits_for(first, second):
+    """Open AsyncFile first, then check that AsyncFile second does not open until
+    first is closed"""
+    await first.open()
+    task = asyncio.ensure_future(second.open())
+    await asyncio.sleep(0.5)
+    assert not task.done()
+    await first.close()
+    await asyncio.wait_for(task, 10)
+    await second.close()
+
+
+def test_writers_exclusive_on_shared_thread(executors, path):
+    executors(1)
+    first, second = h5_lock.AsyncFile(path, 'a'), h5_lock.AsyncFile(path, 'a')
+    asyncio.run(assert_waits_for(first, second))
+
+
+def test_reader_then_writer_on_shared_thread(executors, path):
+    executors(1)
+    first, second = h5_lock.AsyncFile(path, 'r'), h5_lock.AsyncFile(path, 'a')
+    asyncio.run(assert_waits_for(first, second))
+
+
+def test_many_mixed_opens(executors, tmp_path):
+    executors(h5_lock.ASYNC_ZLOCK_WORKERS)
+    paths = [str(tmp_path / ('%d.h5' % i)) for i in range(5)]
+    for path in paths:
+        with h5py.File(path, 'w') as f:
+            f.attrs['count'] = 0
+
+    async def open_one(i):
+        path = paths[i % len(paths)]
+        if i % 2:
+            async with h5_lock.AsyncFile(path, 'r') as f:
+                return f.attrs['count']
+        async with h5_lock.AsyncFile(path, 'a') as f:
+            f.attrs['count'] += 1
+
+    async def main():
+        await asyncio.wait_for(asyncio.gather(*[open_one(i) for i in range(100)]), 60)
+
+    asyncio.run(main())
+    for path in paths:
+        with h5py.File(path, 'r') as f:
+            assert f.attrs['count'] == 10
+
+
+def test_abandoned_open_released_after_shutdown(executors, path):
+    _, hdf5_executor = executors(1)
+    initial_kill_lock_count = kill_lock._n_acquires
+
+    async def abandon_open():
+        task = asyncio.ensure_future(h5_lock.AsyncFile(path, 'r').open())
+        await asyncio.sleep(0.5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    # Hold a write lock so that the open is waiting for its zlock when cancelled:
+    writer = h5py.File(path, 'a')
+    try:
+        asyncio.run(abandon_open())
+        # As happens at interpreter exit:
+        hdf5_executor.shutdown()
+    finally:
+        writer.close()
+
+    async def open_writer():
+        # Only possible once the abandoned File's read lock has been released:
+        async with h5_lock.AsyncFile(path, 'a') as f:
+            f.attrs['count'] += 1
+
+    asyncio.run(asyncio.wait_for(open_writer(), 10))
+    assert kill_lock._n_acquires == initial_kill_lock_count
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+import labscript_utils.h5_lock as h5_lock
+import h5py
+
+
+@pytest.fixture
+def check_sealed_attribute():
+    """Consider files with the sealed attribute sealed, and restore the config and
+    forget known sealed files afterwards"""
+    h5_lock._sealed_config = [], True
+    h5_lock._known_sealed.clear()
+    yield
+    h5_lock._sealed_config = None
+    h5_lock._known_sealed.clear()
+
+
+def test_sealed_file_skips_zlock(tmp_path, check_sealed_attribute):
+    path = str(tmp_path / 'sealed.h5')
+    with h5py.File(path, 'w') as f:
+        f.attrs[h5_lock.SEALED_ATTRIBUTE] = True
+    with h5py.File(path, 'r') as f:
+        assert hasattr(f, 'zlock')
+    with h5py.File(path, 'r') as f:
+        assert not hasattr(f, 'zlock')
+
+
+def test_recreated_unsealed_file_takes_zlock(tmp_path, check_sealed_attribute):
+    path = str(tmp_path / 'sealed.h5')
+    with h5py.File(path, 'w') as f:
+        f.attrs[h5_lock.SEALED_ATTRIBUTE] = True
+    with h5py.File(path, 'r') as f:
+        pass
+    os.unlink(path)
+    with h5py.File(path, 'w') as f:
+        f.attrs['count'] = 0
+    with h5py.File(path, 'r') as f:
+        assert hasattr(f, 'zlock')
+    assert not h5_lock._known_sealed
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from labscript_utils import properties
+import h5py
+
+
+@pytest.fixture
+def group(tmp_path):
+    with h5py.File(str(tmp_path / 'test.h5'), 'w') as f:
+        yield f.create_group('devices/device')
+
+
+def values():
+    return {
+        'small': {'lut': np.linspace(0, 1, 100), 'firmware': b'\x00\x01', 'n': 3},
+        # Larger than HDF5's 64 KiB attribute limit:
+        'large': {'lut': np.linspace(0, 1, 20000), 'units': 'V'},
+    }
+
+
+def assert_equal(value, expected):
+    assert value.keys() == expected.keys()
+    for key, item in expected.items():
+        if isinstance(item, np.ndarray):
+            assert isinstance(value[key], np.ndarray)
+            assert value[key].dtype == item.dtype
+            assert np.array_equal(value[key], item)
+        else:
+            assert value[key] == item
+
+
+def test_binary_round_trip(group):
+    expected = values()
+    properties.set_attributes(group, expected, binary=True)
+    assert properties.is_binary(group.attrs['small'])
+    assert not properties.is_binary(group.attrs['large'])
+    assert properties.BINARY_DATASETS_GROUP in group.file
+    assert_equal(properties.deserialise_binary(group.attrs['small']), expected['small'])
+    for attributes in [
+        properties.get_attributes(group),
+        properties.get_attributes_lazy(group),
+        {name: properties.get_attribute(group, name) for name in expected},
+    ]:
+        for name, value in expected.items():
+            assert_equal(attributes[name], value)
+
+
+def test_binary_overwrite(group):
+    large = values()['large']
+    properties.set_attributes(group, {'x': large}, binary=True)
+    properties.set_attributes(group, {'x': {'a': 1}}, binary=True)
+    assert properties.get_attribute(group, 'x') == {'a': 1}
+    assert properties._binary_dataset_path(group, 'x') not in group.file
+    properties.set_attributes(group, {'x': large}, binary=True)
+    properties.set_attributes(group, {'x': large}, binary=True)
+    assert_equal(properties.get_attribute(group, 'x'), large)
+
+
+def test_json_round_trip(group):
+    expected = values()
+    properties.set_attributes(group, expected)
+    for name, value in expected.items():
+        assert properties.is_json(group.attrs[name])
+        result = properties.get_attribute(group, name)
+        assert result['lut'] == value['lut'].tolist()
@@ -0,0 +1,46 @@
+import pytest
+
+import labscript_utils.shared_filewatcher as shared_filewatcher
+from labscript_utils.shared_filewatcher import FileWatcherServer, SharedFileWatcher
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FileWatcherServer(None)
+    monkeypatch.setattr(
+        shared_filewatcher, 'connect_to_filewatcher_server', lambda: server.port
+    )
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def files(tmp_path):
+    folder = tmp_path / 'folder'
+    folder.mkdir()
+    paths = [tmp_path / 'a.txt', tmp_path / 'b.txt', folder / 'c.txt']
+    for path in paths:
+        path.write_text('hello')
+    return folder, [str(path) for path in paths]
+
+
+def test_unwatch_keeps_files_other_clients_watch(server, files):
+    folder, (a, b, c) = files
+    server.watch('client 1', [a], [str(folder)], [])
+    server.watch('client 2', [a, b], [], [])
+    assert server.watcher.files == {a, b, c}
+    server.unwatch('client 1')
+    assert server.watcher.files == {a, b}
+    assert server.watcher.folders == set()
+    server.unwatch('client 2')
+    assert server.watcher.files == set()
+    assert server.watcher.modified_info == {}
+
+
+def test_stop_unwatches(server, files):
+    folder, (a, b, c) = files
+    watcher = SharedFileWatcher(lambda *args: None, files=[a], folders=[str(folder)])
+    assert server.watcher.files == {a, c}
+    watcher.stop()
+    assert server.watcher.files == set()
+    assert server._watches == {}
@@ -0,0 +1,48 @@
+import threading
+
+import numpy as np
+
+import labscript_utils.h5_lock
+from labscript_utils.shot_utils import get_shot_globals, get_shot_globals_many
+import h5py
+
+
+def make_shots(tmp_path, n_shots):
+    paths = []
+    for i in range(n_shots):
+        path = str(tmp_path / ('shot_%d.h5' % i))
+        with h5py.File(path, 'w') as f:
+            f.create_group('globals').attrs.update(
+                {'index': i, 'flag': np.bool_(i % 2), 'name': 'shot %d' % i}
+            )
+        paths.append(path)
+    return paths
+
+
+def test_threads(tmp_path):
+    paths = make_shots(tmp_path, 5)
+    results = get_shot_globals_many(paths, max_workers=2)
+    assert results == [get_shot_globals(path) for path in paths]
+
+
+def test_processes_with_h5_lock(tmp_path):
+    paths = make_shots(tmp_path, 5)
+    results = []
+    # Previously hung, so run in a thread with a timeout:
+    thread = threading.Thread(
+        target=lambda: results.append(
+            get_shot_globals_many(paths, max_workers=2, use_processes=True)
+        ),
+        daemon=True,
+    )
+    thread.start()
+    thread.join(60)
+    assert results, "get_shot_globals_many() with processes did not complete"
+    assert results[0] == [get_shot_globals(path) for path in paths]
+    assert results[0][1] == {'index': 1, 'flag': True, 'name': 'shot 1'}
+
+
+def test_table(tmp_path):
+    paths = make_shots(tmp_path, 3)
+    table = get_shot_globals_many(paths, as_table=True)
+    assert list(table.index) == [0, 1, 2]